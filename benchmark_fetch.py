@@ -0,0 +1,73 @@
+# Dependencies
+
+# built-ins
+import time # for timing batches
+import random # for picking which responses are slow
+import threading # for running the stand-in server in the background
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler # local stand-in for Reuters
+
+# 3rd-party
+import reuters_fetch # the fetcher being measured
+
+# Measures fetch_links_to_data() against a local stand-in server that answers
+# with a Reuters-like article page, but makes a fraction of responses slow.
+# Every request is slow independently of the others, like a server with a
+# long tail, so a hedged second attempt is usually fast.
+# Usage: python benchmark_fetch.py
+NUM_ARTICLES = 200
+SLOW_FRACTION = 0.05 # Fraction of responses that are slow
+SLOW_DELAY = 10 # seconds
+NORMAL_DELAY = (0.02, 0.1) # seconds, picked uniformly
+MAX_WORKERS = 8
+
+ARTICLE_HTML = '''<html><head><title>Company {0} reports results</title>
+<meta property="article:published_time" content="2020-01-02T14:00:00Z"></head>
+<body><article><h1>Company {0} reports results</h1>
+<p>NEW YORK (Reuters) - Company {0} said on Thursday its quarterly revenue rose, beating analysts' estimates, helped by strong demand.</p>
+<p>The company also raised its full-year forecast and said it expected margins to improve in the second half of the year.</p>
+<p>Reporting by Jane Doe in New York; Editing by Bob Smith</p>
+</article></body></html>'''
+
+class StandInHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		if random.random() < SLOW_FRACTION:
+			time.sleep(SLOW_DELAY)
+		else:
+			time.sleep(random.uniform(*NORMAL_DELAY))
+		body = ARTICLE_HTML.format(self.path.strip('/')).encode('utf-8')
+		try:
+			self.send_response(200)
+			self.send_header('Content-Type', 'text/html; charset=utf-8')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+		except (BrokenPipeError, ConnectionResetError):
+			pass # The fetcher already gave up on this request
+
+	def log_message(self, *args):
+		pass # Keep the output readable
+
+def run_batch(name, links, **kwargs):
+	# Fetches {links} with the given fetch_links_to_data() settings and prints how it went
+	started = time.time()
+	results, retry_queue = reuters_fetch.fetch_links_to_data(links, max_workers = MAX_WORKERS, **kwargs)
+	elapsed = time.time() - started
+	print('{:<32} batch time: {:6.2f}s   parsed: {:4d}   retry queue: {:4d} {}'.format(
+		name, elapsed, results['body_text'].notnull().sum(), len(retry_queue),
+		retry_queue['cause'].value_counts().to_dict() if len(retry_queue) > 0 else ''))
+
+if __name__ == '__main__':
+	server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+	threading.Thread(target = server.serve_forever, daemon = True).start()
+	base_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+	links = ['{}/article-{}'.format(base_url, i) for i in range(NUM_ARTICLES)]
+
+	print('{} articles, {:.0%} of responses delayed by {}s, {} workers'.format(NUM_ARTICLES, SLOW_FRACTION, SLOW_DELAY, MAX_WORKERS))
+	run_batch('no deadline', links, request_deadline = SLOW_DELAY * 2)
+	run_batch('2s request deadline', links, request_deadline = 2)
+	run_batch('2s request, 5s batch deadline', links, request_deadline = 2, batch_deadline = 5)
+	# The runs above filled the latency history, so the p95 is known from here on
+	run_batch('2s request deadline + hedging', links, request_deadline = 2, hedge = True)
+	print('p95 latency used for hedging: {:.3f}s'.format(reuters_fetch.get_hedge_latency()))
+
+	server.shutdown()
@@ -0,0 +1,84 @@
+# Dependencies
+
+# built-ins
+import os # for file sizes
+import time # for timing searches
+import shutil # for cleaning up afterwards
+import tempfile # for keeping the benchmark files out of the way
+
+# 3rd-party
+import numpy as np # for generating articles
+import pandas as pd # for the pandas scan being compared against
+import reuters_search # the search index being measured
+
+# Compares reuters_search.search() with what finding articles used to take:
+# loading the articles and running str.contains over the full_article column.
+# The articles are generated (Reuters-like boilerplate around random words),
+# with "guidance cut" planted in a small fraction of them.
+# Usage: python benchmark_search.py
+NUM_ARTICLES = 100000
+WORDS_PER_ARTICLE = 300
+PHRASE = 'guidance cut'
+PHRASE_FRACTION = 0.01 # Fraction of articles the phrase is planted in
+SEED = 1
+
+def generate_articles():
+	# Generates {NUM_ARTICLES} articles for 500 made-up stocks over 4 years
+	rng = np.random.default_rng(SEED)
+	vocabulary = np.array(['word{}'.format(i) for i in range(20000)])
+	stocks = np.array(['STK{}'.format(i) for i in range(500)])
+	bodies = []
+	for i in range(NUM_ARTICLES):
+		words = vocabulary[rng.zipf(1.3, WORDS_PER_ARTICLE) % len(vocabulary)].tolist()
+		if rng.random() < PHRASE_FRACTION:
+			words.insert(rng.integers(len(words)), PHRASE)
+		bodies.append('NEW YORK (Reuters) - ' + ' '.join(words) + ' Reporting by Jane Doe; Editing by Bob Smith')
+	return pd.DataFrame({'article_id': ['{:016x}'.format(i) for i in range(NUM_ARTICLES)],
+						 'stock': stocks[rng.integers(0, len(stocks), NUM_ARTICLES)],
+						 'article_publish_date': pd.to_datetime('2017-01-01', utc = True) + pd.to_timedelta(rng.integers(0, 4 * 365, NUM_ARTICLES), unit = 'D'),
+						 'full_article': bodies})
+
+def time_it(func, repeat = 5):
+	# Best of {repeat} runs, in seconds, and the last result
+	best = np.inf
+	for i in range(repeat):
+		started = time.time()
+		result = func()
+		best = min(best, time.time() - started)
+	return best, result
+
+if __name__ == '__main__':
+	directory = tempfile.mkdtemp()
+	csv_path = os.path.join(directory, 'articles.csv')
+	index_path = os.path.join(directory, 'search_index')
+
+	print('Generating {} articles...'.format(NUM_ARTICLES))
+	datas = generate_articles()
+	datas.to_csv(csv_path)
+
+	started = time.time()
+	reuters_search.build_search_index(datas['article_id'], datas['stock'], datas['article_publish_date'], datas['full_article'], index_path)
+	index_size = sum(os.path.getsize(os.path.join(root, file)) for root, dirs, files in os.walk(index_path) for file in files)
+	print('Index built in {:.1f}s, {:.1f} MB on disk (articles .csv: {:.1f} MB)'.format(
+		time.time() - started, index_size / 1e6, os.path.getsize(csv_path) / 1e6))
+
+	def pandas_scan(start = None, tickers = None):
+		matches = datas[datas['full_article'].str.contains(PHRASE, case = False, regex = False)]
+		if start is not None:
+			matches = matches[matches['article_publish_date'] >= pd.Timestamp(start, tz = 'UTC')]
+		if tickers is not None:
+			matches = matches[matches['stock'].isin(tickers)]
+		return matches
+
+	load_time, loaded = time_it(lambda: pd.read_csv(csv_path, index_col = 0), repeat = 1)
+	scan_time, scanned = time_it(pandas_scan)
+	index_time, found = time_it(lambda: reuters_search.search(PHRASE, path = index_path))
+	print('"{}": pandas load {:.2f}s + scan {:.3f}s ({} matches), index {:.3f}s ({} matches)'.format(
+		PHRASE, load_time, scan_time, len(scanned), index_time, len(found)))
+
+	scan_time, scanned = time_it(lambda: pandas_scan('2019-01-01', ['STK1', 'STK2', 'STK3']))
+	index_time, found = time_it(lambda: reuters_search.search(PHRASE, start = '2019-01-01', tickers = ['STK1', 'STK2', 'STK3'], path = index_path))
+	print('"{}" since 2019 for 3 stocks: pandas scan {:.3f}s ({} matches), index {:.3f}s ({} matches)'.format(
+		PHRASE, scan_time, len(scanned), index_time, len(found)))
+
+	shutil.rmtree(directory)
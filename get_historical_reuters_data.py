@@ -6,12 +6,19 @@ import time # for wait functions
 import multiprocessing # get how many CPUs are in your PC
 
 # 3rd-party
+import numpy as np # for NaNs
 import pandas as pd # for data processing and .csv I/O 
 from tqdm import tqdm # for progress bars
 from newspaper import Article # for parsing Reuters articles 
 from selenium import webdriver # for web scraping
 from datetime import datetime # for getting today's date
 from joblib import Parallel, delayed # for parallel processing
+from reuters_body_store import get_article_id, write_bodies_to_store # for storing compressed article bodies
+from reuters_dedup import assign_header_clusters, assign_story_clusters, get_reusable_rewrites, normalize_header # for grouping near-duplicate stories
+from reuters_search import build_search_index # for the keyword search index
+from reuters_rollup import build_rollups # for the daily sentiment rollups
+from reuters_fetch import REQUEST_DEADLINE # for the article download deadline
+from reuters_schedule import load_run_stats, save_run_stats, run_timed, fetch_links_task, load_article_counts, estimate_listing_costs, estimate_article_cost, split_stragglers, predict_makespan, report_makespan # for handing out the longest tasks first
 
 # Functions
 def get_data_for_stock(stock):
@@ -73,7 +80,7 @@ def get_data_for_stock(stock):
 		if condition: # If {stock} has been found in Reuters, continue
 
 			# Click the element's link, going to Reuters's 
- 			driver.find_element_by_xpath('/html/body/div[4]/section[2]/div/div[1]/div[3]/div/div/div/div[1]/a').click()
+			driver.find_element_by_xpath('/html/body/div[4]/section[2]/div/div[1]/div[3]/div/div/div/div[1]/a').click()
 			time.sleep(0.5) # Let the stock's Reuters page load
 
 			# Go to the "News" section of the stock's Reuters page
@@ -175,12 +182,12 @@ nyse_listed = pd.read_csv('nyse-listed_csv.csv', index_col = 0).reset_index()
 nasdaq_listed = pd.read_csv('nasdaq-listed-symbols_csv.csv', index_col = 0).reset_index()
 nasdaq_listed.columns = ['ACT Symbol', 'Company Name']
 # Append the NASDAQ stock list to the NYSE stock list
-nyse_listed = nyse_listed.append(nasdaq_listed)
+nyse_listed = pd.concat([nyse_listed, nasdaq_listed])
 # Load all US stocks that aren't on the NYSE or NASDAQ
 other_listed = pd.read_csv('other-listed_csv.csv', index_col = 0).reset_index()
 other_listed = other_listed[['ACT Symbol', 'Company Name']]
 # Append the other stock list to the NYSE + NASDAQ stock list
-nyse_listed = nyse_listed.append(other_listed)
+nyse_listed = pd.concat([nyse_listed, other_listed])
 # Get all unique ticker symbols from the NYSE + NASDAQ + Other stock list
 symbols = nyse_listed['ACT Symbol'].unique().tolist()
 all_stocks = [] # All stocks will be the stocks that are going to be processed
@@ -250,7 +257,7 @@ while True:
 						elif confirm == 'n':
 							print('Okay,')
 							bp = False
-							continue
+							break
 						else:
 							print("Please type 'Y' or 'N'. Caps doesn't matter.")
 
@@ -274,7 +281,7 @@ while True:
 					elif confirm == 'n':
 						print('Okay,')
 						bp = False
-						continue
+						break
 					else:
 						print("Please type 'Y' or 'N'. Caps doesn't matter.")
 		
@@ -283,6 +290,7 @@ while True:
 
 num_scraper_cores = num_cores_to_use
 
+bp = False
 while True:
 	if bp:
 		break
@@ -308,7 +316,7 @@ while True:
 						elif confirm == 'n':
 							print('Okay,')
 							bp = False
-							continue
+							break
 						else:
 							print("Please type 'Y' or 'N'. Caps doesn't matter.")
 
@@ -332,7 +340,7 @@ while True:
 					elif confirm == 'n':
 						print('Okay,')
 						bp = False
-						continue
+						break
 					else:
 						print("Please type 'Y' or 'N'. Caps doesn't matter.")
 		
@@ -340,6 +348,11 @@ while True:
 		print('Please input an integer or nothing.')
 
 num_parser_cores = num_cores_to_use
+# Article download settings, passed on to reuters_fetch.fetch_links_to_data()
+request_deadline = REQUEST_DEADLINE # Seconds per article
+batch_deadline = None # Seconds per fetch task, None for no limit
+hedge = False # Send a second request for downloads slower than the recent p95
+fetch_workers = 1 # Download threads per parser core
 print('Setting verbosity to high is recommended to make sure your script is still operational.')
 while True:
 	
@@ -380,16 +393,28 @@ while True:
 	confirm = confirm.replace(' ', '')
 	if confirm == 'y':
 		print('Scraping all Reuters news articles. This ~12 hours to run on 16 threads.')
-		Parallel(num_scraper_cores, 'loky', verbose = 20)(delayed(get_data_for_stock)(stock) for stock in all_stocks)
+		# Hand out the stocks whose listing took the longest last time first, so
+		# no long stock gets started at the very end of the run. Stocks that
+		# weren't listed before are estimated from the previous reuters_data.csv.
+		run_stats = load_run_stats()
+		listing_costs = estimate_listing_costs(all_stocks, run_stats, load_article_counts())
+		ordered_stocks = sorted(all_stocks, key = listing_costs.get, reverse = True)
+		predicted = predict_makespan([listing_costs[stock] for stock in ordered_stocks], num_scraper_cores)
+		started = time.time()
+		timings = Parallel(num_scraper_cores, 'loky', verbose = 20, batch_size = 1)(delayed(run_timed)(get_data_for_stock, stock, 'listing', stock) for stock in ordered_stocks)
+		report_makespan('Scraping', predicted, time.time() - started)
+		save_run_stats(timings)
+		break
 	elif confirm == 'n':
 		print('Ok, skipping.')
+		break
 	else:
 		print("""Please type "y" or "n". Caps doesn't matter.""")
 		continue
 
 print('All reuters articles have been scraped. Downloading into a pandas Dataframe...')
 datas = [] 
-for file in tqdm(os.listdir('reuters_data')):
+for file in tqdm(sorted(os.listdir('reuters_data'))): # Sorted so positions match between runs
     path = 'reuters_data/{}'.format(file)
     data = pd.read_csv(path, index_col = 0)
     if len(data) > 0:
@@ -400,16 +425,72 @@ datas = pd.concat(datas)
 datas = datas.drop_duplicates(keep = 'first').dropna().reset_index(drop = True)
 links = datas['link']
 datas.columns = ['header'] + datas.columns[1:].tolist()
+
+# drop_duplicates() only removes exact matches, so rewrites of the same story
+# ("UPDATE 1", "UPDATE 2", brief/long versions) are grouped into story clusters.
+# Only headers exist before parsing, so they decide which rewrites don't need
+# to be downloaded: {header_clusters} holds the position of each article's
+# cluster representative, {header_unchanged} flags members whose header is
+# practically the same as it. Only members that are the same link, or a rewrite
+# of the story under the same stock, may skip the download: recurring headers
+# like "Stocks to watch" are different stories. Once bodies are in, stories are
+# clustered again on header + body.
+print('Clustering near-duplicate headers...')
+header_clusters, header_unchanged = assign_header_clusters(datas['header'].tolist())
+header_unchanged = get_reusable_rewrites(datas['header'].tolist(), links.tolist(), datas['stock'].tolist(), header_clusters, header_unchanged)
+print('{} articles have {} distinct headers.'.format(len(header_clusters), len(set(header_clusters))))
+while True:
+	confirm = input("Do you want to skip downloading and sentiment scoring for unchanged rewrites of a story? (y/n): ")
+	confirm = confirm.lower()
+	confirm = confirm.replace(' ', '')
+	if confirm == 'y':
+		skip_unchanged = True
+		break
+	elif confirm == 'n':
+		skip_unchanged = False
+		break
+	else:
+		print("""Please type "y" or "n". Caps doesn't matter.""")
+		continue
+
 while True:
 	confirm = input("Do you want to parse downloaded articles? Type 'n' if you have already scraped it. (y/n): ")
 	confirm = confirm.lower()
 	confirm = confirm.replace(' ', '')
 	if confirm == 'y':
 		print('Parsing all scraped articles. This takes ~4-5 hours to run on 4 threads.')
-		reuters_processed = Parallel(num_parser_cores, 'loky', verbose = 20)(delayed(get_data_for_stock)(stock) for stock in all_stocks)
+		# Each stock's articles are one fetch task, except for stocks with so many
+		# articles that they'd hold up the run; those are split into chunks.
+		# Tasks are handed out longest first.
+		run_stats = load_run_stats()
+		article_cost = estimate_article_cost(run_stats)
+		to_fetch = datas[~(skip_unchanged & header_unchanged)]
+		fetch_jobs = [(stock, to_fetch.index[positions].tolist()) for stock, positions in to_fetch.groupby('stock').indices.items()]
+		fetch_jobs = split_stragglers(fetch_jobs, num_parser_cores)
+		fetch_jobs = sorted(fetch_jobs, key = lambda job: len(job[1]), reverse = True)
+		predicted = predict_makespan([len(positions) * article_cost for stock, positions in fetch_jobs], num_parser_cores)
+		started = time.time()
+		timings = Parallel(num_parser_cores, 'loky', verbose = 20, batch_size = 1)(delayed(run_timed)(fetch_links_task, stock, 'fetch', links.values[positions].tolist(),
+																										   request_deadline, batch_deadline, hedge, fetch_workers) for stock, positions in fetch_jobs)
+		report_makespan('Parsing', predicted, time.time() - started)
+		save_run_stats(timings)
+
+		# Put every chunk's articles back in the same order as {datas}, skipped
+		# rewrites aren't in it
+		reuters_processed = pd.concat([timing[4][0].set_index(pd.Index(positions)) for timing, (stock, positions) in zip(timings, fetch_jobs)]).sort_index()
 		reuters_processed.to_csv('reuters_processed2.csv')
+
+		# Articles that timed out or failed, with the cause, so they can be retried later
+		retry_queues = pd.concat([timing[4][1].assign(stock = stock) for timing, (stock, positions) in zip(timings, fetch_jobs)])
+		if len(retry_queues) > 0:
+			os.makedirs('retry_queue', exist_ok = True)
+			for stock, retry_queue in retry_queues.groupby('stock'):
+				retry_queue.drop(columns = ['stock']).to_csv('retry_queue/{}.csv'.format(stock.replace('.', '_')), index = False)
+		break
 	elif confirm == 'n':
 		print('Ok, skipping.')
+		reuters_processed = pd.read_csv('reuters_processed2.csv', index_col = 0)
+		break
 	else:
 		print("""Please type "y" or "n". Caps doesn't matter.""")
 		continue
@@ -418,12 +499,65 @@ print('Data mining is complete. Processing data into a usable format.')
 
 from nltk.sentiment.vader import SentimentIntensityAnalyzer as SIA
 
-reuters_processed = pd.read_csv('reuters_processed2.csv', index_col = 0)
-datas.columns = reuters_processed
+# The parsed data is indexed by position in {datas}. Rewrites that weren't
+# downloaded are marked as reused and take their author and publish date from
+# their story representative, so they still count in the rollups and
+# date-filtered searches. Their body is left NaN unless it's the same link.
+reused = ~datas.index.isin(reuters_processed.index)
+reuters_processed = reuters_processed.reindex(datas.index)
+representatives = header_clusters[reused]
+authors = reuters_processed['author'].values.copy()
+authors[reused] = authors[representatives]
+publish_dates = reuters_processed['publish_date'].values.copy()
+publish_dates[reused] = publish_dates[representatives]
+full_articles = reuters_processed['body_text'].values.copy()
+same_link = reused & (links.values == links.values[header_clusters])
+full_articles[same_link] = full_articles[header_clusters[same_link]]
+datas['author'] = authors
+datas['article_publish_date'] = publish_dates
+datas['full_article'] = full_articles
+datas['processed_header'] = [normalize_header(header) for header in datas['header']]
+
+# Now that bodies exist, cluster stories on header + body. Reused rewrites
+# are clustered with their header representative's body.
+print('Clustering near-duplicate stories...')
+bodies = datas['full_article'].values.copy()
+bodies[reused] = bodies[header_clusters[reused]]
+story_texts = [header + ' ' + body if isinstance(body, str) else header for header, body in zip(datas['processed_header'], bodies)]
+story_clusters, unchanged = assign_story_clusters(story_texts)
+print('{} articles were grouped into {} stories.'.format(len(story_clusters), len(set(story_clusters))))
+
 sentiments = []
-for i in tqdm(datas.index):
+for position, i in enumerate(tqdm(datas.index)):
+    # Representatives come first, so they have already been scored
+    if reused[position]:
+        sentiments.append(sentiments[header_clusters[position]])
+        continue
+    if skip_unchanged and unchanged[position]:
+        sentiments.append(sentiments[story_clusters[position]])
+        continue
     sentiments.append(SIA().polarity_scores(datas.loc[i, 'header']))
 sentiments = pd.DataFrame(sentiments)
 datas[sentiments.columns] = sentiments
-datas.columns = ['raw_header', 'reuters_url', 'stock', 'article_publish_date', 'full_article', 'processed_header', 'neg_sentiment', 'neu_sentiment', 'pos_sentiment', 'compound_sentiment']
-datas.to_csv('reuters_data.csv')
\ No newline at end of file
+datas['reused'] = reused
+datas = datas[['header', 'link', 'stock', 'author', 'article_publish_date', 'full_article', 'processed_header', 'neg', 'neu', 'pos', 'compound', 'reused']]
+datas.columns = ['raw_header', 'reuters_url', 'stock', 'author', 'article_publish_date', 'full_article', 'processed_header', 'neg_sentiment', 'neu_sentiment', 'pos_sentiment', 'compound_sentiment', 'reused']
+
+# Article bodies are by far the biggest part of the dataset, so they go to the
+# compressed body store instead of reuters_data.csv. Use reuters_body_store's
+# read_body_from_store() / read_bodies_for_date_range() to get them back.
+print('Compressing article bodies into the body store...')
+datas['article_id'] = [get_article_id(link) for link in datas['reuters_url']]
+datas['story_cluster'] = datas['article_id'].values[story_clusters] # Article id of the story's representative
+# The store trains its dictionary on the first batch big enough to train on
+write_bodies_to_store(datas['article_id'], datas['article_publish_date'], datas['full_article'], 'reuters_data')
+
+# Keyword search over headers and bodies, see reuters_search.search()
+print('Building the search index...')
+build_search_index(datas['article_id'], datas['stock'], datas['article_publish_date'], datas['raw_header'].fillna('') + ' ' + datas['full_article'].fillna(''))
+datas = datas.drop(columns = ['full_article'])
+datas.to_csv('reuters_data.csv')
+
+# Daily per-stock sentiment aggregates for backtests, see reuters_rollup.query_rollups()
+print('Building daily sentiment rollups...')
+build_rollups(datas)
\ No newline at end of file
@@ -0,0 +1,276 @@
+# Dependencies
+
+# built-ins
+import os # making and reading directories
+import random # for sampling articles to train the dictionary on
+import hashlib # for turning Reuters links into article ids
+
+# 3rd-party
+import numpy as np # for NaN checks
+import pandas as pd # for data processing and .csv I/O
+import zstandard as zstd # for compressing article bodies
+
+# The body store is a folder of trained zstd dictionaries shared by every
+# article, plus any number of shards. Each shard is a pair of files:
+# {shard}.zst - every compressed article body in that shard, back to back
+# {shard}.csv - the index: article_id, publish_date, offset, length, dict_id
+# Shards let parallel scraper workers each write to their own files (one shard
+# per stock) without stepping on each other.
+# Dictionaries are never overwritten: each one is saved as dictionary_{dict_id}.zdict
+# and every index row records the dict_id its body was compressed with (0 for
+# none), so training a new dictionary never makes older bodies unreadable.
+# current_dictionary.txt holds the dict_id new bodies are compressed with.
+BODY_STORE_DIR = 'reuters_bodies'
+DICTIONARY_FILE = 'dictionary_{}.zdict'
+CURRENT_DICTIONARY_FILE = 'current_dictionary.txt'
+DICTIONARY_SIZE = 112640 # 110 KB, zstd's recommended default dictionary size
+COMPRESSION_LEVEL = 19
+TRAINING_SAMPLE_SIZE = 5000 # Amount of articles the dictionary is trained on
+TRAINING_MIN_BODIES = 1000 # Bodies the store needs before a dictionary is trained automatically
+INDEX_COLUMNS = ['article_id', 'publish_date', 'offset', 'length', 'dict_id']
+INDEX_DTYPES = {'article_id': str} # Ids that are all digits would be read as ints otherwise
+
+_index_cache = {} # path --> (modification times of the shard indexes, index DataFrame)
+_decompressors = {} # (path, dict_id) --> zstd.ZstdDecompressor
+
+# Functions
+def get_article_id(link: str):
+	# get_article_id()
+
+	# Reuters links are unique per article but long, so the article id is the
+	# first 16 hex digits of the link's SHA-1. The same link always maps to
+	# the same id, so the scraper and the consolidation step agree on it.
+
+	# Input: link (str) - link to a Reuters article
+	# Output: article id (str)
+
+	return hashlib.sha1(str(link).encode('utf-8')).hexdigest()[:16]
+
+def train_body_dictionary(bodies, path = BODY_STORE_DIR, sample_size = TRAINING_SAMPLE_SIZE):
+	# train_body_dictionary()
+
+	# Trains a zstd dictionary on a random sample of article bodies, saves it to
+	# {path}/dictionary_{dict_id}.zdict and makes it the one new bodies are
+	# compressed with. Reuters copy repeats a lot of boilerplate (datelines,
+	# "Reporting by ...", "Editing by ..."), which the dictionary picks up so
+	# that even short articles compress well.
+	# Raises FileExistsError instead of overwriting an existing dictionary.
+
+	# Input: bodies (iterable of strs) - article bodies to sample from
+	#        path (str) - body store folder
+	#        sample_size (int) - amount of articles to train on
+	# Output: the trained dictionary (zstd.ZstdCompressionDict)
+
+	bodies = [body for body in bodies if isinstance(body, str) and len(body) > 0]
+	if len(bodies) > sample_size:
+		bodies = random.sample(bodies, sample_size)
+	samples = [body.encode('utf-8') for body in bodies]
+
+	dictionary = zstd.train_dictionary(DICTIONARY_SIZE, samples)
+
+	if not os.path.isdir(path):
+		os.makedirs(path)
+	# Mode 'xb' fails if the file is already there
+	with open(os.path.join(path, DICTIONARY_FILE.format(dictionary.dict_id())), 'xb') as f:
+		f.write(dictionary.as_bytes())
+
+	# Write to a temporary file and rename it, so other workers never read half a dict_id
+	temporary_path = os.path.join(path, '{}.{}'.format(CURRENT_DICTIONARY_FILE, os.getpid()))
+	with open(temporary_path, 'w') as f:
+		f.write(str(dictionary.dict_id()))
+	os.replace(temporary_path, os.path.join(path, CURRENT_DICTIONARY_FILE))
+	return dictionary
+
+def load_body_dictionary(path = BODY_STORE_DIR, dict_id = None):
+	# load_body_dictionary()
+
+	# Input: path (str) - body store folder
+	#        dict_id (int) - dictionary to load, defaults to the current one
+	# Output: the dictionary (zstd.ZstdCompressionDict), or None if no
+	#         dictionary has been trained yet
+
+	if dict_id is None:
+		current_path = os.path.join(path, CURRENT_DICTIONARY_FILE)
+		if not os.path.exists(current_path):
+			return None
+		with open(current_path) as f:
+			dict_id = int(f.read())
+	with open(os.path.join(path, DICTIONARY_FILE.format(dict_id)), 'rb') as f:
+		return zstd.ZstdCompressionDict(f.read())
+
+def _train_dictionary_if_ready(bodies, path):
+	# The scraper writes to the store before any dictionary exists. Once the
+	# store holds TRAINING_MIN_BODIES bodies (counting the ones being written),
+	# a dictionary is trained on them, so everything written afterwards uses it.
+	# Bodies written before that stay readable without one.
+	stored = load_body_index(path) if os.path.isdir(path) else pd.DataFrame(columns = INDEX_COLUMNS)
+	bodies = [body for body in bodies if isinstance(body, str)]
+	if len(stored) + len(bodies) < TRAINING_MIN_BODIES:
+		return None
+	sample = bodies + read_bodies(stored.index[:TRAINING_SAMPLE_SIZE].tolist(), path).tolist()
+	try:
+		return train_body_dictionary(sample, path)
+	except FileExistsError:
+		return load_body_dictionary(path) # Another worker trained the same dictionary first
+
+def write_bodies_to_store(article_ids, publish_dates, bodies, shard, path = BODY_STORE_DIR):
+	# write_bodies_to_store()
+
+	# Compresses each body with the store's current dictionary and appends it to
+	# {path}/{shard}.zst, adding one row per article to {path}/{shard}.csv.
+	# If no dictionary has been trained yet, one is trained as soon as the store
+	# has enough bodies; until then bodies are compressed without one (dict_id 0).
+	# Articles already in the shard and missing bodies (NaN) are skipped.
+
+	# Input: article_ids (list of strs) - ids from get_article_id()
+	#        publish_dates (list) - publish date of each article
+	#        bodies (list of strs) - full article text
+	#        shard (str) - shard name, e.g. the stock's ticker
+	#        path (str) - body store folder
+	# Output: amount of bodies written (int)
+
+	article_ids, publish_dates, bodies = list(article_ids), list(publish_dates), list(bodies)
+	if not os.path.isdir(path):
+		os.makedirs(path)
+
+	dictionary = load_body_dictionary(path)
+	if dictionary is None:
+		dictionary = _train_dictionary_if_ready(bodies, path)
+	if dictionary is not None:
+		compressor = zstd.ZstdCompressor(level = COMPRESSION_LEVEL, dict_data = dictionary)
+		dict_id = dictionary.dict_id()
+	else:
+		compressor = zstd.ZstdCompressor(level = COMPRESSION_LEVEL)
+		dict_id = 0
+
+	data_path = os.path.join(path, '{}.zst'.format(shard))
+	index_path = os.path.join(path, '{}.csv'.format(shard))
+
+	if os.path.exists(index_path):
+		already_stored = set(pd.read_csv(index_path, usecols = ['article_id'], dtype = INDEX_DTYPES)['article_id'])
+	else:
+		already_stored = set()
+
+	rows = []
+	with open(data_path, 'ab') as f:
+		offset = f.tell() # Appending, so this is the current size of the shard
+		for article_id, publish_date, body in zip(article_ids, publish_dates, bodies):
+			if (not isinstance(body, str)) or (article_id in already_stored):
+				continue
+			frame = compressor.compress(body.encode('utf-8'))
+			f.write(frame)
+			rows.append([article_id, publish_date, offset, len(frame), dict_id])
+			already_stored.add(article_id)
+			offset += len(frame)
+
+	if len(rows) > 0:
+		rows = pd.DataFrame(rows, columns = INDEX_COLUMNS)
+		rows.to_csv(index_path, mode = 'a', header = not os.path.exists(index_path), index = False)
+	return len(rows)
+
+def load_body_index(path = BODY_STORE_DIR):
+	# load_body_index()
+
+	# Reads every shard's index into one DataFrame indexed by article_id.
+	# The result is cached and only re-read when a shard index changes on disk,
+	# so repeated lookups don't pay for parsing the index every time.
+
+	# Input: path (str) - body store folder
+	# Output: pd.DataFrame with columns shard, publish_date, offset, length, dict_id
+
+	index_files = sorted(file for file in os.listdir(path) if file.endswith('.csv'))
+	mtimes = tuple(os.path.getmtime(os.path.join(path, file)) for file in index_files)
+
+	if path in _index_cache and _index_cache[path][0] == mtimes:
+		return _index_cache[path][1]
+
+	indexes = []
+	for file in index_files:
+		index = pd.read_csv(os.path.join(path, file), dtype = INDEX_DTYPES)
+		index['shard'] = file[:-4]
+		indexes.append(index)
+
+	if len(indexes) > 0:
+		index = pd.concat(indexes, ignore_index = True)
+	else:
+		index = pd.DataFrame(columns = INDEX_COLUMNS + ['shard'])
+	index['publish_date'] = pd.to_datetime(index['publish_date'], utc = True, errors = 'coerce', format = 'mixed')
+	# The same article can show up under several stocks; keep the first copy
+	index = index.drop_duplicates('article_id', keep = 'first').set_index('article_id')
+
+	_index_cache[path] = (mtimes, index)
+	return index
+
+def _decompress(frame, dict_id, path):
+	# Decompresses a frame with the dictionary it was compressed with
+	dict_id = int(dict_id)
+	if (path, dict_id) not in _decompressors:
+		if dict_id == 0:
+			_decompressors[(path, dict_id)] = zstd.ZstdDecompressor()
+		else:
+			_decompressors[(path, dict_id)] = zstd.ZstdDecompressor(dict_data = load_body_dictionary(path, dict_id))
+	return _decompressors[(path, dict_id)].decompress(frame).decode('utf-8')
+
+def read_bodies(article_ids, path = BODY_STORE_DIR):
+	# read_bodies()
+
+	# Batch decompression of the given articles. Frames are read shard by
+	# shard in file order so the reads stay sequential.
+
+	# Input: article_ids (list of strs) - ids from get_article_id()
+	#        path (str) - body store folder
+	# Output: pd.Series of full article text indexed by article_id
+	#         (articles that aren't stored are left out)
+
+	index = load_body_index(path)
+	index = index.loc[index.index.intersection(article_ids)]
+
+	bodies = {}
+	for shard, rows in index.sort_values(['shard', 'offset']).groupby('shard'):
+		with open(os.path.join(path, '{}.zst'.format(shard)), 'rb') as f:
+			for article_id, row in rows.iterrows():
+				f.seek(int(row['offset']))
+				frame = f.read(int(row['length']))
+				bodies[article_id] = _decompress(frame, row['dict_id'], path)
+	return pd.Series(bodies, dtype = object)
+
+def read_body_from_store(article_id: str, path = BODY_STORE_DIR):
+	# read_body_from_store()
+
+	# Random access: seeks straight to the article's frame and only
+	# decompresses that one body.
+
+	# Input: article_id (str) - id from get_article_id()
+	#        path (str) - body store folder
+	# Output: full article text (str), or NaN if the article isn't stored
+
+	index = load_body_index(path)
+	if article_id not in index.index:
+		return np.nan
+	row = index.loc[article_id]
+
+	with open(os.path.join(path, '{}.zst'.format(row['shard'])), 'rb') as f:
+		f.seek(int(row['offset']))
+		frame = f.read(int(row['length']))
+	return _decompress(frame, row['dict_id'], path)
+
+def read_bodies_for_date_range(start, end, path = BODY_STORE_DIR):
+	# read_bodies_for_date_range()
+
+	# Batch decompression of every article published between {start} and {end}
+	# (inclusive).
+
+	# Input: start, end (anything pd.Timestamp accepts) - date range, UTC
+	#        path (str) - body store folder
+	# Output: pd.Series of full article text indexed by article_id
+
+	start = pd.Timestamp(start)
+	end = pd.Timestamp(end)
+	if start.tzinfo is None:
+		start = start.tz_localize('UTC')
+	if end.tzinfo is None:
+		end = end.tz_localize('UTC')
+
+	index = load_body_index(path)
+	index = index[(index['publish_date'] >= start) & (index['publish_date'] <= end)]
+	return read_bodies(index.index.tolist(), path)
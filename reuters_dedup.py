@@ -0,0 +1,157 @@
+# Dependencies
+
+# built-ins
+import re # for cleaning up headers
+import zlib # for hashing shingles (stable across processes, unlike hash())
+
+# 3rd-party
+import numpy as np # for MinHash signatures
+
+# Reuters publishes the same story many times: "UPDATE 1", "UPDATE 2", brief and
+# long versions, corrections... drop_duplicates() only removes exact matches,
+# so these get MinHash signatures and are grouped with locality-sensitive
+# hashing (LSH). Every article is hashed into BANDS buckets, and two articles
+# that share any bucket end up in the same story cluster. This is linear in
+# the amount of articles, no pairwise comparisons are made.
+NUM_PERMUTATIONS = 128
+BANDS = 16 # BANDS * ROWS must equal NUM_PERMUTATIONS
+ROWS = 8   # With 16 bands of 8 rows, stories that are ~70%+ similar get clustered
+SHINGLE_SIZE = 3 # Words per shingle for article bodies
+HEADER_SHINGLE_SIZE = 1 # Headers are too short for multi-word shingles
+UNCHANGED_THRESHOLD = 0.9 # Estimated similarity to the cluster's first article
+						  # above which an article counts as unchanged
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+SEED = 1
+
+# Prefixes Reuters puts in front of rewrites of the same story
+HEADER_PREFIX = re.compile(r'^((UPDATE \d+|CORRECTED|REFILE|BRIEF|RPT|EXCLUSIVE|WRAPUP \d+|TIMELINE)[\s:-]+)+', re.IGNORECASE)
+# The ones that mark a new version of an earlier story, rather than a kind of story
+REWRITE_PREFIX = re.compile(r'^(UPDATE \d+|CORRECTED|REFILE|RPT)[\s:-]', re.IGNORECASE)
+WORD = re.compile(r'\w+')
+
+_random = np.random.RandomState(SEED)
+_a = _random.randint(1, MAX_HASH, NUM_PERMUTATIONS, dtype = np.uint64)
+_b = _random.randint(0, MAX_HASH, NUM_PERMUTATIONS, dtype = np.uint64)
+
+# Functions
+def normalize_header(header):
+	# normalize_header()
+
+	# Strips the prefixes Reuters adds to rewrites of a story
+	# e.g.
+	# UPDATE 2-Apple beats estimates --> apple beats estimates
+
+	# Input: header (str) - article header
+	# Output: normalized header (str)
+
+	if not isinstance(header, str):
+		return ''
+	return HEADER_PREFIX.sub('', header.strip()).lower()
+
+def get_shingles(text, shingle_size = SHINGLE_SIZE):
+	# get_shingles()
+
+	# Input: text (str) - article text
+	#        shingle_size (int) - amount of words per shingle
+	# Output: np.array (uint64) of hashed word shingles
+
+	if not isinstance(text, str):
+		text = ''
+	words = WORD.findall(text.lower())
+	if len(words) < shingle_size:
+		shingles = [' '.join(words)]
+	else:
+		shingles = set(' '.join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1))
+	return np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype = np.uint64)
+
+def get_minhash_signatures(texts, shingle_size = SHINGLE_SIZE):
+	# get_minhash_signatures()
+
+	# Input: texts (list of strs) - article texts
+	#        shingle_size (int) - amount of words per shingle
+	# Output: np.array of shape (len(texts), NUM_PERMUTATIONS), one MinHash signature per row
+
+	signatures = np.empty((len(texts), NUM_PERMUTATIONS), dtype = np.uint64)
+	for i, text in enumerate(texts):
+		shingles = get_shingles(text, shingle_size)
+		# One universal hash per permutation, (a * x + b) mod p, applied to every shingle at once
+		hashes = (np.outer(_a, shingles) + _b[:, None]) % MERSENNE_PRIME
+		signatures[i] = hashes.min(axis = 1) & MAX_HASH
+	return signatures
+
+def _find(parents, i):
+	# Union-find lookup with path halving
+	while parents[i] != i:
+		parents[i] = parents[parents[i]]
+		i = parents[i]
+	return i
+
+def assign_story_clusters(texts, shingle_size = SHINGLE_SIZE):
+	# assign_story_clusters()
+
+	# Groups near-duplicate articles into story clusters. Each cluster is
+	# labeled with the position of its first article, so iterating in order
+	# always reaches an article's cluster representative before the article.
+
+	# Input: texts (list of strs) - article texts (headers, bodies, or both)
+	#        shingle_size (int) - amount of words per shingle
+	# Output: clusters (np.array of ints) - position of each article's representative
+	#         unchanged (np.array of bools) - True for cluster members whose text
+	#         is at least UNCHANGED_THRESHOLD similar to the representative's,
+	#         i.e. their parsing and scoring can be reused from the representative
+	# Texts without any words (empty, missing, or e.g. a header that was only
+	# "BRIEF-") say nothing about the story, so each gets its own cluster and
+	# is never marked unchanged.
+
+	signatures = get_minhash_signatures(texts, shingle_size)
+	parents = list(range(len(texts)))
+	has_words = np.array([isinstance(text, str) and WORD.search(text) is not None for text in texts], dtype = bool)
+	with_words = np.flatnonzero(has_words)
+
+	for band in range(BANDS):
+		buckets = {}
+		band_signatures = signatures[:, band * ROWS:(band + 1) * ROWS]
+		for i in with_words:
+			key = band_signatures[i].tobytes()
+			if key in buckets:
+				# Union: the lower position always becomes the root
+				root_i, root_j = _find(parents, i), _find(parents, buckets[key])
+				if root_i != root_j:
+					parents[max(root_i, root_j)] = min(root_i, root_j)
+			else:
+				buckets[key] = i
+
+	clusters = np.array([_find(parents, i) for i in range(len(texts))], dtype = int)
+	similarity = (signatures == signatures[clusters]).mean(axis = 1)
+	unchanged = (clusters != np.arange(len(texts))) & (similarity >= UNCHANGED_THRESHOLD) & has_words
+	return clusters, unchanged
+
+def assign_header_clusters(headers):
+	# assign_header_clusters()
+
+	# assign_story_clusters() for headers only, which is all there is before
+	# articles are downloaded. Headers are normalized first so that
+	# "UPDATE 1-..." and "UPDATE 2-..." of a story compare as the same text.
+
+	# Input: headers (list of strs) - article headers
+	# Output: same as assign_story_clusters()
+
+	return assign_story_clusters([normalize_header(header) for header in headers], HEADER_SHINGLE_SIZE)
+
+def get_reusable_rewrites(headers, links, stocks, clusters, unchanged):
+	# get_reusable_rewrites()
+
+	# Header clusters span every stock and year, and recurring headers
+	# ("Stocks to watch", "BRIEF-... declares quarterly dividend") are separate
+	# stories that just read the same. So an unchanged cluster member only
+	# counts as a copy of its representative if it's the same link, or if it's
+	# a rewrite ("UPDATE 2-", "REFILE-", ...) listed under the same stock.
+
+	# Input: headers, links, stocks (lists of strs) - one per article
+	#        clusters, unchanged (np.arrays) - from assign_header_clusters()
+	# Output: np.array of bools, True for articles whose data can be taken
+	#         from their cluster representative
+	links, stocks = np.asarray(links, dtype = object), np.asarray(stocks, dtype = object)
+	rewrite = np.array([isinstance(header, str) and REWRITE_PREFIX.match(header.strip()) is not None for header in headers], dtype = bool)
+	return unchanged & ((links == links[clusters]) | ((stocks == stocks[clusters]) & rewrite))
@@ -0,0 +1,132 @@
+# Dependencies
+
+# built-ins
+import time # for deadlines
+import queue # for collecting finished downloads
+import threading # for running downloads in the background
+from collections import deque # for the rolling latency history
+
+# 3rd-party
+import numpy as np # for NaNs and latency percentiles
+import pandas as pd # for the retry queue
+from newspaper import Article # for parsing Reuters articles
+
+# A few slow URLs used to decide when a whole ticker finished, since
+# Article.download() had no deadline. Every download now runs in its own
+# background thread and is given up on once it passes REQUEST_DEADLINE; the
+# batch as a whole can also be given a deadline. With hedging turned on, a
+# second attempt is sent for any download that's slower than the p95 latency
+# of recent downloads, and whichever attempt finishes first is used.
+REQUEST_DEADLINE = 20 # seconds
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20 # Downloads needed before the p95 latency is trusted
+LATENCY_HISTORY = 1000 # Amount of recent download latencies kept
+POLL_INTERVAL = 0.05 # How often (seconds) in-flight downloads are checked on
+SOCKET_TIMEOUT_FACTOR = 2 # newspaper's socket timeout, as a multiple of the request deadline
+
+_latencies = deque(maxlen = LATENCY_HISTORY) # Latencies of recent successful downloads
+
+# Functions
+def get_hedge_latency():
+	# get_hedge_latency()
+
+	# Output: p95 latency (seconds) of recent successful downloads, or None
+	#         if there haven't been enough downloads yet to trust it
+
+	if len(_latencies) < HEDGE_MIN_SAMPLES:
+		return None
+	return np.percentile(_latencies, HEDGE_PERCENTILE)
+
+def _fetch_attempt(position, link, request_timeout, done):
+	# Downloads and parses one article, then reports back through {done}
+	started = time.time()
+	try:
+		article = Article(link, request_timeout = request_timeout) # Instantiate the Article() object
+		article.download() # Download the article
+		article.parse() # Parse the article for data
+		done.put((position, started, [article.authors, article.publish_date, article.text], None))
+	except Exception as e:
+		done.put((position, started, None, e))
+
+def _start_attempt(position, link, request_deadline, done):
+	# Daemon threads, so a download that never returns can't keep the script alive.
+	# newspaper's own socket timeout is only a backstop that ends abandoned threads;
+	# it's set past the deadline so timeouts are reported as request_deadline.
+	thread = threading.Thread(target = _fetch_attempt, args = (position, link, request_deadline * SOCKET_TIMEOUT_FACTOR, done), daemon = True)
+	thread.start()
+
+def fetch_links_to_data(links, request_deadline = REQUEST_DEADLINE, batch_deadline = None, hedge = False, max_workers = 1):
+	# fetch_links_to_data()
+
+	# convert_link_to_data() for a batch of links, with deadlines. Articles that
+	# time out or fail aren't just turned into NaNs: they are put in the retry
+	# queue together with the cause.
+
+	# Input: links (list of strs) - links to Reuters articles
+	#        request_deadline (float) - seconds before a single article is given up on
+	#        batch_deadline (float) - seconds before the whole batch is given up on (None = no deadline)
+	#        hedge (bool) - send a second attempt for articles slower than the p95 latency
+	#        max_workers (int) - amount of articles downloaded at the same time
+	#                            (hedged attempts don't count towards this)
+	# Output: pd.DataFrame (author, publish_date, body_text), one row per link, NaNs
+	#         for articles that didn't make it, and the retry queue as a
+	#         pd.DataFrame (link, cause, elapsed)
+
+	results = [[np.nan, np.nan, np.nan] for link in links]
+	retry_queue = []
+	done = queue.Queue()
+	waiting = deque(range(len(links)))
+	in_flight = {} # position --> started, attempts, failures, hedged
+	batch_started = time.time()
+
+	def give_up(position, cause):
+		retry_queue.append([links[position], cause, time.time() - in_flight[position]['started'] if position in in_flight else 0.0])
+		in_flight.pop(position, None)
+
+	while len(waiting) > 0 or len(in_flight) > 0:
+		if batch_deadline is not None and time.time() - batch_started > batch_deadline:
+			for position in list(in_flight) + list(waiting):
+				give_up(position, 'batch_deadline')
+			break
+
+		# Start new downloads while there are free workers
+		while len(waiting) > 0 and len(in_flight) < max_workers:
+			position = waiting.popleft()
+			in_flight[position] = {'started': time.time(), 'attempts': 1, 'failures': 0, 'hedged': False}
+			_start_attempt(position, links[position], request_deadline, done)
+
+		# Collect finished downloads. Late results from attempts that were already
+		# given up on (or beaten by their hedge) are ignored.
+		try:
+			finished = [done.get(timeout = POLL_INTERVAL)]
+			while not done.empty():
+				finished.append(done.get_nowait())
+		except queue.Empty:
+			finished = []
+		for position, started, data, error in finished:
+			if position not in in_flight:
+				continue
+			if error is None:
+				_latencies.append(time.time() - started)
+				results[position] = data
+				in_flight.pop(position)
+			else:
+				in_flight[position]['failures'] += 1
+				if in_flight[position]['failures'] == in_flight[position]['attempts']:
+					give_up(position, 'error: {}'.format(error))
+
+		# Give up on, or hedge, slow downloads
+		hedge_latency = get_hedge_latency() if hedge else None
+		now = time.time()
+		for position, state in list(in_flight.items()):
+			elapsed = now - state['started']
+			if elapsed > request_deadline:
+				give_up(position, 'request_deadline')
+			elif hedge_latency is not None and not state['hedged'] and elapsed > hedge_latency:
+				state['hedged'] = True
+				state['attempts'] += 1
+				_start_attempt(position, links[position], request_deadline, done)
+
+	results = pd.DataFrame(results, columns = ['author', 'publish_date', 'body_text'])
+	retry_queue = pd.DataFrame(retry_queue, columns = ['link', 'cause', 'elapsed'])
+	return results, retry_queue
@@ -0,0 +1,40 @@
+# Dependencies
+
+# built-ins
+import os # for the lock file
+import time # for waiting on the lock
+from contextlib import contextmanager # for using the lock in a with statement
+
+# The rollups and the search index are read, changed and written back by
+# every update, so two processes updating them at once would lose one's
+# articles (or write the same segment). Writers hold {path}.lock while they
+# update; creating it with O_EXCL fails if another writer already has it.
+LOCK_TIMEOUT = 120 # seconds, a lock older than this was left by a writer that crashed
+
+# Functions
+@contextmanager
+def file_lock(path):
+	# file_lock()
+
+	# Holds {path}.lock, waiting for other writers to let go of it first.
+
+	# Input: path (str) - file or folder the lock is for
+	# Usage: with file_lock(path): ...
+
+	lock_path = path.rstrip('/\\') + '.lock'
+	while True:
+		try:
+			fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+			break
+		except FileExistsError:
+			try:
+				if time.time() - os.path.getmtime(lock_path) > LOCK_TIMEOUT:
+					os.remove(lock_path)
+			except OSError:
+				pass # The other writer just let go of it
+			time.sleep(0.05)
+	try:
+		yield
+	finally:
+		os.close(fd)
+		os.remove(lock_path)
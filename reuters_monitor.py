@@ -0,0 +1,291 @@
+# Dependencies
+
+# built-ins
+import time # for wait functions
+import heapq # priority queue of tickers waiting to be polled
+import math # for rounding the lookback up to whole days
+import threading # for stopping the monitor from another thread
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED # for polling several tickers at once
+from datetime import datetime, timedelta, timezone # for timestamps
+from zoneinfo import ZoneInfo # for US market hours
+
+# 3rd-party
+import numpy as np # for latency percentiles
+import pandas as pd # for data processing
+from reuters_scraper import get_data_for_stock_lb_base, index_new_articles # for listing Reuters articles and adding them to the rollups / search index
+from reuters_fetch import fetch_links_to_data, REQUEST_DEADLINE # for downloading articles with deadlines
+
+# Polling intervals are in seconds. Each ticker's interval is set so that on
+# average about TARGET_ARTICLES_PER_POLL new articles have arrived since the
+# last poll: busy tickers get polled often, quiet ones rarely.
+MIN_INTERVAL = 60
+MAX_INTERVAL = 60 * 60
+INITIAL_INTERVAL = 5 * 60
+TARGET_ARTICLES_PER_POLL = 1
+RATE_SMOOTHING = 0.3 # Weight of the newest poll in the arrival rate average
+OFF_HOURS_MULTIPLIER = 4 # Outside of market hours tickers are polled this much less often
+POLL_WORKERS = 4 # Tickers polled at the same time, each with its own browser
+
+MARKET_TIMEZONE = ZoneInfo('America/New_York')
+MARKET_OPEN = (9, 30)
+MARKET_CLOSE = (16, 0)
+
+# Functions
+def is_market_open(now = None):
+	# is_market_open()
+
+	# Input: now (datetime, timezone-aware) - defaults to the current time
+	# Output: True if US markets are open at {now} (weekdays 9:30 - 16:00 ET).
+	#         Holidays aren't accounted for.
+
+	if now is None:
+		now = datetime.now(timezone.utc)
+	now = now.astimezone(MARKET_TIMEZONE)
+	if now.weekday() >= 5: # Saturday or Sunday
+		return False
+	return MARKET_OPEN <= (now.hour, now.minute) < MARKET_CLOSE
+
+def get_next_market_open(now = None):
+	# get_next_market_open()
+
+	# Input: now (datetime, timezone-aware) - defaults to the current time
+	# Output: the next time US markets open after {now}, as a UNIX timestamp (float)
+
+	if now is None:
+		now = datetime.now(timezone.utc)
+	now = now.astimezone(MARKET_TIMEZONE)
+	market_open = now.replace(hour = MARKET_OPEN[0], minute = MARKET_OPEN[1], second = 0, microsecond = 0)
+	if market_open <= now:
+		market_open += timedelta(days = 1)
+	while market_open.weekday() >= 5: # Skip the weekend
+		market_open += timedelta(days = 1)
+	return market_open.timestamp()
+
+def get_next_poll_time(interval, now = None):
+	# get_next_poll_time()
+
+	# Outside market hours, polls are never scheduled past the next open, so a
+	# stretched off-hours interval can't delay the first poll of the session.
+
+	# Input: interval (float) - seconds until the ticker should be polled again
+	#        now (float) - UNIX timestamp, defaults to the current time
+	# Output: UNIX timestamp of the ticker's next poll (float)
+
+	if now is None:
+		now = time.time()
+	now_datetime = datetime.fromtimestamp(now, timezone.utc)
+	if is_market_open(now_datetime):
+		return now + interval
+	return min(now + interval, get_next_market_open(now_datetime))
+
+def get_polling_interval(arrival_rate, market_open = True):
+	# get_polling_interval()
+
+	# Input: arrival_rate (float) - smoothed amount of new articles per second
+	#        market_open (bool) - whether markets are currently open
+	# Output: seconds to wait before polling the ticker again (float)
+
+	if arrival_rate > 0:
+		interval = TARGET_ARTICLES_PER_POLL / arrival_rate
+	else:
+		interval = MAX_INTERVAL
+	interval = min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+	if not market_open:
+		interval *= OFF_HOURS_MULTIPLIER
+	return interval
+
+def get_publish_timestamp(publish_date):
+	# Turns newspaper's publish date into a UTC pd.Timestamp (NaT if missing).
+	# Dates without a timezone are assumed to be UTC.
+	publish_date = pd.Timestamp(publish_date) if publish_date is not None else pd.NaT
+	if pd.isnull(publish_date):
+		return pd.NaT
+	if publish_date.tzinfo is None:
+		return publish_date.tz_localize('UTC')
+	return publish_date.tz_convert('UTC')
+
+def poll_ticker(stock: str, seen_links: set, lookback_seconds: float, download = True, request_deadline = REQUEST_DEADLINE):
+	# poll_ticker()
+
+	# Scans the ticker's news listing and only downloads articles whose links
+	# haven't been seen yet. Successfully downloaded links are added to
+	# {seen_links}; links that timed out or failed aren't, so the next poll
+	# tries them again.
+
+	# Input: stock (str) - ticker symbol
+	#        seen_links (set of strs) - links already fetched for this ticker
+	#        lookback_seconds (float) - how far back the listing scan should go
+	#        download (bool) - False only marks the listed links as seen, without
+	#                          downloading anything (for the warm-up poll)
+	#        request_deadline (float) - seconds before a download is given up on
+	# Output: list of dicts (stock, header, link, author, publish_date, text)
+
+	days_to_look_back = max(1, math.ceil(lookback_seconds / (24 * 60 * 60)))
+	listing = get_data_for_stock_lb_base(stock, days_to_look_back, seen_links)
+	if not isinstance(listing, pd.DataFrame):
+		return [] # The listing scan failed, try again on the next poll
+
+	listing = listing[~listing['link'].isin(seen_links)].drop_duplicates('link')
+	if not download:
+		seen_links.update(listing['link'])
+		return []
+
+	fetched, retry_queue = fetch_links_to_data(listing['link'].tolist(), request_deadline = request_deadline)
+	failed = set(retry_queue['link'])
+
+	articles = []
+	for (header, link), (author, publish_date, text) in zip(listing[['text', 'link']].values.tolist(), fetched.values.tolist()):
+		if link in failed:
+			continue
+		seen_links.add(link)
+		articles.append({'stock': stock, 'header': header, 'link': link, 'author': author,
+						 'publish_date': publish_date, 'text': text})
+	return articles
+
+def deliver_article(article, deliver):
+	# Pushes an article to either a queue (anything with a put() method) or a callback
+	if hasattr(deliver, 'put'):
+		deliver.put(article)
+	else:
+		deliver(article)
+
+def get_detection_latency_report(latencies):
+	# get_detection_latency_report()
+
+	# Detection latency is the time between an article's publish date and
+	# when the monitor delivered it.
+
+	# Input: latencies (list of floats) - detection latencies in seconds
+	# Output: dict with count, mean, median, p95 and max latency in seconds
+
+	if len(latencies) == 0:
+		return {'count': 0, 'mean': np.nan, 'median': np.nan, 'p95': np.nan, 'max': np.nan}
+	latencies = np.asarray(latencies, dtype = float)
+	return {'count': len(latencies), 'mean': latencies.mean(), 'median': np.median(latencies),
+			'p95': np.percentile(latencies, 95), 'max': latencies.max()}
+
+def run_watchlist_monitor(watchlist, deliver, stop_event = None, verbose = False, seen_links = None, request_deadline = REQUEST_DEADLINE, poll_workers = POLL_WORKERS,
+						  rollup_path = None, search_path = None):
+	# run_watchlist_monitor()
+
+	# Long-running monitor for a watchlist. Replaces calling
+	# get_data_for_stock_with_lookback(stock, 1) in a cron loop:
+	# - each ticker keeps a set of seen links, so only new articles are downloaded,
+	#   and the listing scan stops at the first link that has been seen
+	# - each ticker's polling interval follows its observed news arrival rate
+	# - tickers wait in a priority queue ordered by when they're due; if several
+	#   are due at once, the busiest goes first. Outside market hours every
+	#   interval is stretched by OFF_HOURS_MULTIPLIER, but never past the next
+	#   open, and when the market opens every ticker is due right away
+	# - up to {poll_workers} due tickers are polled at the same time, so one slow
+	#   listing scan doesn't hold up every other ticker
+	# - downloads have a deadline, so one hung article can't stall the monitor
+	# - new articles are pushed to {deliver} as soon as they're parsed, then
+	#   added to the daily sentiment rollups / search index if {rollup_path} /
+	#   {search_path} are given
+	# - a failing poll, delivery or index update is printed and skipped, it
+	#   doesn't stop the monitor
+
+	# The first poll of each ticker only fills its seen set (nothing is
+	# downloaded or delivered), so starting the monitor doesn't replay the
+	# whole lookback.
+	# Pass {seen_links} from a previous run to skip that warm-up.
+
+	# Input: watchlist (list of strs) - ticker symbols
+	#        deliver (callable or queue.Queue) - receives one dict per new article
+	#        stop_event (threading.Event) - set it to stop the monitor
+	#        verbose (bool) - print each poll and the latency report
+	#        seen_links (dict of stock --> set of links) - seen sets to start from
+	#        request_deadline (float) - seconds before a download is given up on
+	#        poll_workers (int) - amount of tickers polled at the same time
+	#        rollup_path (str) - rollup .npz file to add new articles to
+	#        search_path (str) - search index folder to add new articles to
+	# Output: detection latency report (dict) once the monitor is stopped
+
+	if stop_event is None:
+		stop_event = threading.Event()
+	if seen_links is None:
+		seen_links = {}
+
+	arrival_rates = {stock: 0.0 for stock in watchlist} # Smoothed articles per second
+	last_polled = {}
+	latencies = []
+	polling = {} # future --> (stock, poll start time, warm-up poll or not)
+
+	queue = [(time.time(), 0.0, stock) for stock in watchlist]
+	heapq.heapify(queue)
+	market_open = is_market_open()
+
+	def finish_poll(stock, now, warm_up, future):
+		# Delivers a finished poll's articles and puts the ticker back in the queue
+		try:
+			articles = future.result()
+		except Exception as e:
+			print('{} - poll failed: {}'.format(stock, e))
+			articles = []
+
+		if not warm_up:
+			for article in articles:
+				try:
+					deliver_article(article, deliver)
+				except Exception as e:
+					print('{} - delivering {} failed: {}'.format(stock, article['link'], e))
+					continue
+				publish_date = get_publish_timestamp(article['publish_date'])
+				if not pd.isnull(publish_date):
+					latencies.append((pd.Timestamp.now(tz = 'UTC') - publish_date).total_seconds())
+			if len(articles) > 0 and (rollup_path is not None or search_path is not None):
+				index_new_articles(pd.DataFrame(articles), rollup_path, search_path) # Prints its own errors
+
+			# Update the ticker's arrival rate with what came in since its last poll
+			elapsed = max(now - last_polled.get(stock, now - INITIAL_INTERVAL), 1)
+			arrival_rates[stock] = RATE_SMOOTHING * (len(articles) / elapsed) + (1 - RATE_SMOOTHING) * arrival_rates[stock]
+
+		last_polled[stock] = now
+		interval = INITIAL_INTERVAL if warm_up else get_polling_interval(arrival_rates[stock], is_market_open())
+		heapq.heappush(queue, (get_next_poll_time(interval), -arrival_rates[stock], stock))
+
+		if verbose:
+			print('{} - {} new articles, next poll in {:.0f}s'.format(stock, 0 if warm_up else len(articles), interval))
+
+	with ThreadPoolExecutor(max_workers = poll_workers) as executor:
+		while not stop_event.is_set() and (len(queue) > 0 or len(polling) > 0):
+			if is_market_open() and not market_open:
+				# The market just opened: every ticker is due now, busiest first
+				now = time.time()
+				queue = [(min(due, now), -arrival_rates[stock], stock) for due, _, stock in queue]
+				heapq.heapify(queue)
+			market_open = is_market_open()
+
+			# Hand due tickers to free workers
+			while len(queue) > 0 and len(polling) < poll_workers and queue[0][0] <= time.time():
+				due, _, stock = heapq.heappop(queue)
+				now = time.time()
+				warm_up = stock not in seen_links
+				seen = seen_links.setdefault(stock, set())
+				lookback = now - last_polled.get(stock, now - 24 * 60 * 60)
+				future = executor.submit(poll_ticker, stock, seen, lookback, download = not warm_up, request_deadline = request_deadline)
+				polling[future] = (stock, now, warm_up)
+
+			# Wait for a poll to finish or the next ticker to be due, waking up
+			# regularly to check stop_event
+			timeout = 1
+			if len(queue) > 0 and len(polling) < poll_workers:
+				timeout = min(timeout, max(queue[0][0] - time.time(), 0))
+			if len(polling) > 0:
+				done, _ = wait(list(polling), timeout = timeout, return_when = FIRST_COMPLETED)
+				for future in done:
+					stock, now, warm_up = polling.pop(future)
+					finish_poll(stock, now, warm_up, future)
+			else:
+				stop_event.wait(timeout)
+
+		# Polls still running have already marked their links as seen, so what
+		# they bring back is delivered before stopping
+		for future, (stock, now, warm_up) in polling.items():
+			finish_poll(stock, now, warm_up, future)
+
+	report = get_detection_latency_report(latencies)
+	if verbose:
+		print('Detection latency (seconds): {}'.format(report))
+	return report
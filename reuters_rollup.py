@@ -0,0 +1,236 @@
+# Dependencies
+
+# built-ins
+import os # for checking if the rollup file exists
+import hashlib # for the keys of articles already added
+import tempfile # for writing the rollups atomically
+
+# 3rd-party
+import numpy as np # for the rollup arrays
+import pandas as pd # for data processing
+from reuters_lock import file_lock # for updating the rollups from several processes
+
+# Backtests only need daily aggregates per stock, so instead of reloading
+# reuters_data.csv and grouping it every time, the aggregates are kept in a
+# small .npz file. Rows are sorted by stock, then date, and stored as flat
+# arrays; ticker_offsets[i]:ticker_offsets[i + 1] is the slice of rows for
+# tickers[i]. Means aren't stored, sums are, so the rollups can be updated
+# incrementally and the mean worked out at query time. article_keys holds a
+# 64-bit hash of (stock, article_id) for every article in the rollups, so the
+# same article is never added twice.
+# Updates read, change and write the whole file, so they hold {path}.lock
+# while they do; several processes can update the same rollups.
+ROLLUP_FILE = 'sentiment_rollups.npz'
+SENTIMENT_COLUMNS = ['compound_sentiment', 'pos_sentiment', 'neg_sentiment']
+
+_rollup_cache = {} # path --> (modification time, rollups)
+
+# Functions
+def _to_day_numbers(dates):
+	# Turns publish dates into UTC day numbers (days since 1970-01-01). Each
+	# date's format is worked out on its own, since they come from different
+	# sources (csv strings, Timestamps, with and without a time zone)
+	dates = pd.to_datetime(pd.Series(dates), utc = True, errors = 'coerce', format = 'mixed').dt.tz_convert(None)
+	return dates.values.astype('datetime64[D]').astype(np.int64)
+
+def _to_day_number(date):
+	# Same for one date, e.g. a query bound. Unlike _to_day_numbers(), a date
+	# that can't be parsed raises an error instead of becoming NaT
+	date = pd.Timestamp(date)
+	if date.tzinfo is not None:
+		date = date.tz_convert('UTC').tz_localize(None)
+	return np.int64(date.to_datetime64().astype('datetime64[D]').astype(np.int64))
+
+def _aggregate(daily):
+	# Collapses rows with the same stock and date into one. {daily} has a count,
+	# sum, min and max column per sentiment column, which combine without
+	# needing the original articles.
+	aggregations = {'count': 'sum'}
+	for column in SENTIMENT_COLUMNS:
+		aggregations.update({column + '_sum': 'sum', column + '_min': 'min', column + '_max': 'max'})
+	return daily.groupby(['stock', 'date'], sort = True).agg(aggregations).reset_index()
+
+def _to_arrays(daily):
+	# Turns an aggregated, sorted DataFrame into the rollup arrays
+	tickers, starts = np.unique(daily['stock'].to_numpy(dtype = str), return_index = True)
+	rollups = {'tickers': tickers,
+			   'ticker_offsets': np.append(starts, len(daily)).astype(np.int64),
+			   'dates': daily['date'].values.astype(np.int32),
+			   'count': daily['count'].values.astype(np.int32)}
+	for column in SENTIMENT_COLUMNS:
+		for stat in ['sum', 'min', 'max']:
+			rollups['{}_{}'.format(column, stat)] = daily['{}_{}'.format(column, stat)].values.astype(np.float32)
+	return rollups
+
+def _to_daily(rollups):
+	# The inverse of _to_arrays()
+	counts = np.diff(rollups['ticker_offsets'])
+	daily = pd.DataFrame({'stock': np.repeat(rollups['tickers'], counts), 'date': rollups['dates'], 'count': rollups['count']})
+	for column in SENTIMENT_COLUMNS:
+		for stat in ['sum', 'min', 'max']:
+			daily['{}_{}'.format(column, stat)] = rollups['{}_{}'.format(column, stat)]
+	return daily
+
+def _article_keys(stocks, article_ids):
+	# Stable 64-bit hash of each (stock, article_id) pair. The same article can
+	# be listed under several stocks, and counts once for each of them.
+	return np.array([int.from_bytes(hashlib.blake2b('{} {}'.format(stock, article_id).encode('utf-8'), digest_size = 8).digest(), 'little')
+					 for stock, article_id in zip(stocks, article_ids)], dtype = np.uint64)
+
+def _select_articles(datas, added_keys):
+	# Articles that can go in the rollups: ones with a publish date and sentiment
+	# scores, that aren't in {added_keys} yet. Returns them and their keys.
+	keys = _article_keys(datas['stock'].values, datas['article_id'].values)
+	usable = pd.to_datetime(datas['article_publish_date'].values, utc = True, errors = 'coerce', format = 'mixed').notnull()
+	usable &= datas[SENTIMENT_COLUMNS].notnull().all(axis = 1).values
+	usable &= ~np.isin(keys, added_keys)
+	usable &= ~pd.Series(keys).duplicated().values
+	return datas[usable], keys[usable]
+
+def _articles_to_daily(datas):
+	# One row per article --> one row per article with the columns _aggregate() expects
+	daily = pd.DataFrame({'stock': datas['stock'].values, 'date': _to_day_numbers(datas['article_publish_date'].values), 'count': 1})
+	for column in SENTIMENT_COLUMNS:
+		values = datas[column].values.astype(np.float64)
+		daily[column + '_sum'] = values
+		daily[column + '_min'] = values
+		daily[column + '_max'] = values
+	return daily
+
+def build_rollups(datas, path = ROLLUP_FILE):
+	# build_rollups()
+
+	# Builds the daily rollups from scratch and saves them to {path}.
+	# Articles without a publish date or sentiment scores are left out.
+
+	# Input: datas (pd.DataFrame) - articles with article_id, stock,
+	#        article_publish_date and the SENTIMENT_COLUMNS, like reuters_data.csv
+	#        path (str) - rollup .npz file
+	# Output: rollups (dict of np.arrays)
+
+	with file_lock(path):
+		return _build_rollups(datas, path)
+
+def _build_rollups(datas, path):
+	datas, keys = _select_articles(datas, np.array([], dtype = np.uint64))
+	rollups = _to_arrays(_aggregate(_articles_to_daily(datas)))
+	rollups['article_keys'] = np.sort(keys)
+	save_rollups(rollups, path)
+	return rollups
+
+def update_rollups(new_datas, path = ROLLUP_FILE):
+	# update_rollups()
+
+	# Adds newly scraped articles to the rollups at {path}. Articles that are
+	# already in the rollups (same stock and article_id) are skipped, so
+	# passing the same articles again doesn't count them twice.
+
+	# Input: new_datas (pd.DataFrame) - same columns as for build_rollups()
+	#        path (str) - rollup .npz file
+	# Output: rollups (dict of np.arrays)
+
+	with file_lock(path):
+		if not os.path.exists(path):
+			return _build_rollups(new_datas, path)
+		return _update_rollups(new_datas, path)
+
+def _update_rollups(new_datas, path):
+	rollups = load_rollups(path)
+	added_keys = rollups.get('article_keys', np.array([], dtype = np.uint64))
+	new_datas, keys = _select_articles(new_datas, added_keys)
+	if len(new_datas) == 0:
+		return rollups
+	daily = pd.concat([_to_daily(rollups), _articles_to_daily(new_datas)], ignore_index = True)
+	rollups = _to_arrays(_aggregate(daily))
+	rollups['article_keys'] = np.union1d(added_keys, keys)
+	save_rollups(rollups, path)
+	return rollups
+
+def save_rollups(rollups, path = ROLLUP_FILE):
+	# save_rollups()
+
+	# Writes to a temporary file first and then swaps it in, so a query never
+	# reads a half-written file.
+
+	# Input: rollups (dict of np.arrays) - from build_rollups()
+	#        path (str) - rollup .npz file
+	# Output: None
+
+	fd, temp_path = tempfile.mkstemp(suffix = '.tmp', dir = os.path.dirname(os.path.abspath(path)))
+	with os.fdopen(fd, 'wb') as f: # A file object stops numpy from adding its own .npz extension
+		np.savez(f, **rollups)
+	os.replace(temp_path, path)
+	_rollup_cache.pop(path, None)
+
+def load_rollups(path = ROLLUP_FILE):
+	# load_rollups()
+
+	# The rollups are kept in memory after the first load, and re-read if the
+	# file changes, so repeated queries don't touch the disk.
+
+	# Input: path (str) - rollup .npz file
+	# Output: rollups (dict of np.arrays)
+
+	mtime = os.path.getmtime(path)
+	if path in _rollup_cache and _rollup_cache[path][0] == mtime:
+		return _rollup_cache[path][1]
+	with np.load(path) as f:
+		rollups = {key: f[key] for key in f.files}
+	rollups['ticker_index'] = {ticker: i for i, ticker in enumerate(rollups['tickers'])}
+	rollups['ticker_rows'] = np.repeat(np.arange(len(rollups['tickers'])), np.diff(rollups['ticker_offsets'])) # Ticker of each row
+	_rollup_cache[path] = (mtime, rollups)
+	return rollups
+
+def query_rollups(start, end, column = 'compound_sentiment', stat = 'mean', tickers = None, path = ROLLUP_FILE):
+	# query_rollups()
+
+	# Gets a (ticker x date) matrix of one daily aggregate, straight from the
+	# rollups, without touching the article data.
+
+	# Input: start, end (anything pd.Timestamp accepts) - date range (UTC days, inclusive)
+	#        column (str) - one of SENTIMENT_COLUMNS (ignored for 'count')
+	#        stat (str) - 'count', 'mean', 'min' or 'max'
+	#        tickers (list of strs) - stocks to get, defaults to every stock
+	#        path (str) - rollup .npz file
+	# Output: pd.DataFrame with one row per ticker and one column per day.
+	#         Days without articles are NaN (0 for 'count').
+
+	rollups = load_rollups(path)
+	start_day, end_day = _to_day_number(start), _to_day_number(end)
+	if start_day > end_day:
+		raise ValueError('start ({}) is after end ({})'.format(start, end))
+	num_days = int(end_day - start_day + 1)
+
+	if tickers is None:
+		# Every stock: one pass over all rows
+		tickers = rollups['tickers'].tolist()
+		selected = np.flatnonzero((rollups['dates'] >= start_day) & (rollups['dates'] <= end_day))
+		rows = rollups['ticker_rows'][selected]
+	else:
+		# Some stocks: each stock's dates are sorted, so its rows in the range
+		# are found by binary search
+		offsets = rollups['ticker_offsets']
+		selected, rows = [], []
+		for row, ticker in enumerate(tickers):
+			i = rollups['ticker_index'].get(ticker)
+			if i is None:
+				continue
+			dates = rollups['dates'][offsets[i]:offsets[i + 1]]
+			first = offsets[i] + np.searchsorted(dates, start_day, 'left')
+			last = offsets[i] + np.searchsorted(dates, end_day, 'right')
+			selected.append(np.arange(first, last))
+			rows.append(np.full(last - first, row))
+		selected = np.concatenate(selected) if len(selected) > 0 else np.array([], dtype = np.int64)
+		rows = np.concatenate(rows) if len(rows) > 0 else np.array([], dtype = np.int64)
+
+	if stat == 'count':
+		matrix = np.zeros((len(tickers), num_days), dtype = np.int32)
+		matrix[rows, rollups['dates'][selected] - start_day] = rollups['count'][selected]
+	else:
+		matrix = np.full((len(tickers), num_days), np.nan, dtype = np.float32)
+		values = rollups['{}_{}'.format(column, 'sum' if stat == 'mean' else stat)][selected]
+		if stat == 'mean':
+			values = values / rollups['count'][selected]
+		matrix[rows, rollups['dates'][selected] - start_day] = values
+
+	return pd.DataFrame(matrix, index = tickers, columns = pd.date_range(pd.to_datetime(start_day, unit = 'D'), periods = num_days, freq = 'D'))
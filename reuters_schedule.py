@@ -0,0 +1,174 @@
+# Dependencies
+
+# built-ins
+import os # for checking if the stats file exists
+import time # for timing tasks
+import heapq # for simulating workers
+
+# 3rd-party
+import numpy as np # for NaNs and medians
+import pandas as pd # for data processing and .csv I/O
+from reuters_fetch import fetch_links_to_data, REQUEST_DEADLINE # for downloading articles with deadlines
+
+# The full-universe scrape used to hand tickers to the workers in symbol-file
+# order. Per-ticker cost ranges from seconds (not covered by Reuters) to many
+# minutes (mega-caps with years of news), so a long ticker that started late
+# left the run waiting on a few slow workers. Tasks are now handed out longest
+# first (LPT scheduling), using costs estimated from previous runs, and the
+# article fetching of long tickers is split into chunks so idle workers can help.
+RUN_STATS_FILE = 'run_stats.csv'
+RUN_STATS_COLUMNS = ['stock', 'task', 'seconds', 'units']
+DEFAULT_LISTING_COST = 60 # seconds, for when there are no stats at all yet
+DEFAULT_LISTED_ARTICLE_COST = 0.5 # seconds per listed article on top of that
+PREVIOUS_DATASET_FILE = 'reuters_data.csv' # Consolidated dataset of an earlier scrape
+DEFAULT_ARTICLE_COST = 2 # seconds per article, for when there are no stats at all yet
+STRAGGLER_FRACTION = 0.25 # Fetch tasks estimated above this fraction of an ideal
+						  # worker's share of the total are split into chunks
+
+# Functions
+def load_run_stats(path = RUN_STATS_FILE):
+	# load_run_stats()
+
+	# Input: path (str) - run stats .csv
+	# Output: pd.DataFrame (stock, task, seconds, units) of previous tasks,
+	#         units being the amount of articles a fetch task handled
+
+	if not os.path.exists(path):
+		return pd.DataFrame(columns = RUN_STATS_COLUMNS)
+	return pd.read_csv(path)
+
+def save_run_stats(timings, path = RUN_STATS_FILE):
+	# save_run_stats()
+
+	# Input: timings (list of lists) - [stock, task, seconds, units, result] from run_timed()
+	#        path (str) - run stats .csv, appended to
+	# Output: None
+
+	stats = pd.DataFrame([timing[:4] for timing in timings], columns = RUN_STATS_COLUMNS)
+	stats.to_csv(path, mode = 'a', header = not os.path.exists(path), index = False)
+
+def run_timed(func, stock, task, *args):
+	# run_timed()
+
+	# Runs func(*args) in a worker and times it.
+
+	# Input: func (function) - the task
+	#        stock (str) - ticker symbol the task is for
+	#        task (str) - 'listing' or 'fetch'
+	# Output: [stock, task, seconds, units, result], units being the amount of
+	#         articles for fetch tasks (result being (parsed data, retry queue))
+
+	started = time.time()
+	result = func(*args)
+	seconds = time.time() - started
+	units = len(result[0]) if task == 'fetch' else np.nan
+	return [stock, task, seconds, units, result]
+
+def fetch_links_task(links, request_deadline = REQUEST_DEADLINE, batch_deadline = None, hedge = False, max_workers = 1):
+	# Article-fetch subtask: sends the parsed data and the retry queue back to
+	# the main process, which writes the retry queue to retry_queue/. The other
+	# arguments are passed on to reuters_fetch.fetch_links_to_data().
+	return fetch_links_to_data(links, request_deadline, batch_deadline, hedge, max_workers)
+
+def load_article_counts(path = PREVIOUS_DATASET_FILE):
+	# load_article_counts()
+
+	# Amount of articles each stock had in a previous scrape, as a cheap probe
+	# of how long listing it will take. Only the stock column is read.
+
+	# Input: path (str) - reuters_data.csv from get_historical_reuters_data.py
+	# Output: dict of stock (with '.' as '_', like the reuters_data/ files) --> amount of articles
+
+	if not os.path.exists(path):
+		return {}
+	return pd.read_csv(path, usecols = ['stock'])['stock'].astype(str).value_counts().to_dict()
+
+def estimate_listing_costs(stocks, stats, article_counts = None):
+	# estimate_listing_costs()
+
+	# A stock's listing cost is how long its listing took in the most recent
+	# run. Stocks that already have data are skipped by the scrape, so the stats
+	# mostly cover cheap stocks (few or no articles); stocks without stats are
+	# estimated from their amount of articles in a previous scrape instead:
+	# base cost + cost per listed article * articles. The base cost is the
+	# median listing cost, the cost per article is fitted on stocks that have
+	# both. Stocks with neither get the base cost.
+
+	# Input: stocks (list of strs) - ticker symbols
+	#        stats (pd.DataFrame) - from load_run_stats()
+	#        article_counts (dict) - from load_article_counts()
+	# Output: dict of stock --> estimated seconds
+
+	if article_counts is None:
+		article_counts = {}
+	listings = stats[stats['task'] == 'listing']
+	if len(listings) > 0:
+		default = listings['seconds'].median()
+	else:
+		default = DEFAULT_LISTING_COST
+	latest = listings.groupby('stock')['seconds'].last().to_dict()
+
+	counted = [stock for stock in latest if article_counts.get(stock.replace('.', '_'), 0) > 0]
+	total_articles = sum(article_counts[stock.replace('.', '_')] for stock in counted)
+	if total_articles > 0:
+		article_cost = sum(max(latest[stock] - default, 0) for stock in counted) / total_articles
+	else:
+		article_cost = DEFAULT_LISTED_ARTICLE_COST
+
+	costs = {}
+	for stock in stocks:
+		if stock in latest:
+			costs[stock] = latest[stock]
+		else:
+			costs[stock] = default + article_cost * article_counts.get(stock.replace('.', '_'), 0)
+	return costs
+
+def estimate_article_cost(stats):
+	# estimate_article_cost()
+
+	# Input: stats (pd.DataFrame) - from load_run_stats()
+	# Output: average seconds it took to fetch one article in previous runs (float)
+
+	fetches = stats[stats['task'] == 'fetch']
+	if fetches['units'].sum() > 0:
+		return fetches['seconds'].sum() / fetches['units'].sum()
+	return DEFAULT_ARTICLE_COST
+
+def split_stragglers(jobs, num_workers):
+	# split_stragglers()
+
+	# Splits fetch jobs that would take much longer than the rest into chunks,
+	# so one mega-cap's articles can be spread over several workers.
+
+	# Input: jobs (list of (stock, positions)) - articles to fetch per stock
+	#        num_workers (int) - amount of workers
+	# Output: list of (stock, positions) with every chunk under the straggler limit.
+	#         Every article costs about the same, so the limit is in articles.
+
+	total_articles = sum(len(positions) for stock, positions in jobs)
+	chunk_size = max(1, int(total_articles / num_workers * STRAGGLER_FRACTION))
+	chunks = []
+	for stock, positions in jobs:
+		for start in range(0, len(positions), chunk_size):
+			chunks.append((stock, positions[start:start + chunk_size]))
+	return chunks
+
+def predict_makespan(costs, num_workers):
+	# predict_makespan()
+
+	# Simulates handing the tasks out in the given order to whichever worker
+	# frees up first.
+
+	# Input: costs (list of floats) - estimated seconds per task, in dispatch order
+	#        num_workers (int) - amount of workers
+	# Output: predicted seconds until the last task finishes (float)
+
+	workers = [0.0] * num_workers
+	for cost in costs:
+		heapq.heappush(workers, heapq.heappop(workers) + cost)
+	return max(workers)
+
+def report_makespan(name, predicted, actual):
+	# Prints how long a step was predicted to take vs. how long it took
+	print('{}: predicted makespan {:.0f}s, actual makespan {:.0f}s ({:+.0%})'.format(
+		name, predicted, actual, (actual - predicted) / predicted if predicted > 0 else 0))
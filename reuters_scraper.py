@@ -13,9 +13,16 @@ from newspaper import Article # for parsing Reuters articles
 from selenium import webdriver # for web scraping
 from datetime import datetime # for getting today's date
 from joblib import Parallel, delayed # for parallel processing
+from reuters_body_store import get_article_id, write_bodies_to_store # for storing compressed article bodies
+from reuters_dedup import assign_header_clusters, get_reusable_rewrites # for grouping near-duplicate stories
+from reuters_fetch import fetch_links_to_data, REQUEST_DEADLINE # for downloading articles with deadlines
+from reuters_rollup import update_rollups, ROLLUP_FILE # for the daily sentiment rollups
+from reuters_search import update_search_index, SEARCH_INDEX_DIR # for the keyword search index
+from nltk.sentiment.vader import SentimentIntensityAnalyzer as SIA # for scoring headers
 
 # Functions
-def get_data_for_stock(stock, verbose = False):
+def get_data_for_stock(stock, verbose = False, request_deadline = REQUEST_DEADLINE, batch_deadline = None, hedge = False, max_workers = 1,
+					   rollup_path = None, search_path = None):
 	# get_data_for_stock()
 
 	# Takes input "stock" and outputs a {stock}.csv file to the reuters_data directory.
@@ -24,6 +31,10 @@ def get_data_for_stock(stock, verbose = False):
 	# script again if it is stopped (e.g. your PC crashes, you have to kill the script)
 
 	# Input: stock (str) - ticker symbol of a designated stock
+	#        request_deadline, batch_deadline, hedge, max_workers - passed on to
+	#        reuters_fetch.fetch_links_to_data() for downloading the articles
+	#        rollup_path, search_path (strs) - outside massive scrapes, add the
+	#        articles to the rollups / search index there, see index_new_articles()
 	# Output: None
 
 	# Set the Firefox webdriver to run headless in the background
@@ -163,14 +174,26 @@ def get_data_for_stock(stock, verbose = False):
 			datas = pd.DataFrame(datas, columns = ['text', 'link']) # Compile the list of headers and links into a pandas DataFrame
 			if verbose == False:
 				print('Scraping for further information....')
-			links_data = Parallel(1, 'threading', verbose = 0)(delayed(convert_link_to_data)(link) for link in datas['link'].values.tolist())
-			links_data = pd.DataFrame(links_data, columns = ['author', 'publish_date', 'body_text'])
+			links_data, retry_queue = fetch_links_to_data(datas['link'].values.tolist(), request_deadline, batch_deadline, hedge, max_workers)
 
 
 			if massive_scrape_mode == True:
+				# Article bodies go to the compressed body store (one shard per stock),
+				# the csv only keeps the article id pointing into it
+				links_data['article_id'] = [get_article_id(link) for link in datas['link']]
+				write_bodies_to_store(links_data['article_id'], links_data['publish_date'], links_data['body_text'], stock.replace('.', '_'))
+				links_data = links_data.drop(columns = ['body_text'])
 				links_data.to_csv('reuters_data/{}.csv'.format(stock.replace('.', '_'))) # Export the data to the reuters data folder under the name {stock}.csv
+				if len(retry_queue) > 0:
+					# Articles that timed out or failed, with the cause, so they can be retried later
+					os.makedirs('retry_queue', exist_ok = True)
+					retry_queue.to_csv('retry_queue/{}.csv'.format(stock.replace('.', '_')), index = False)
 			else:
-				pass
+				# Massive scrapes run many of these at once, so there the rollups are
+				# built when get_historical_reuters_data.py consolidates the data
+				index_new_articles(pd.DataFrame({'stock': stock, 'header': datas['text'].values, 'link': datas['link'].values,
+												 'publish_date': links_data['publish_date'].values, 'text': links_data['body_text'].values}),
+								   rollup_path, search_path)
 		else:
 			if verbose:
 				print('Stock not found on reuters.')
@@ -224,7 +247,7 @@ from tqdm import tqdm
 from newspaper import Article
 from selenium import webdriver
 
-def get_data_for_stock_lb_base(stock: str, days_to_look_back: int):
+def get_data_for_stock_lb_base(stock: str, days_to_look_back: int, seen_links = None):
 	# get_data_for_stock()
 
 	# Takes input "stock" and outputs a {stock}.csv file to the reuters_data directory.
@@ -233,6 +256,9 @@ def get_data_for_stock_lb_base(stock: str, days_to_look_back: int):
 	# script again if it is stopped (e.g. your PC crashes, you have to kill the script)
 
 	# Input: stock (str) - ticker symbol of a designated stock
+	#        seen_links (set of strs) - the listing is newest first, so the scan
+	#        stops at the first of these links instead of going through the
+	#        whole lookback
 	# Output: None
 
 	# Set the Firefox webdriver to run headless in the background
@@ -331,6 +357,8 @@ def get_data_for_stock_lb_base(stock: str, days_to_look_back: int):
 
 					header = driver.find_element_by_xpath(xpath).text # Get the article's header text
 					link = driver.find_element_by_xpath(xpath).get_attribute('href') # Get the link of the article
+					if seen_links is not None and link in seen_links:
+						break # Everything from here on has been seen already
 					date = driver.find_element_by_xpath('/html/body/div[1]/div/div[4]/div[1]/div/div/div/div[2]/div[{}]/div/div/time'.format(i)).text
 					#/html/body/div[1]/div/div[4]/div[1]/div/div/div/div[2]/div[7]/div/div/time
 					datas.append([header, link])
@@ -372,10 +400,157 @@ def get_data_for_stock_lb_base(stock: str, days_to_look_back: int):
 					  # to save space on RAM
 		return np.nan
 
-def get_data_for_stock_with_lookback(stock: str, days_to_look_back: int):
+def get_data_for_stock_with_lookback(stock: str, days_to_look_back: int, skip_near_duplicates = False,
+									 request_deadline = REQUEST_DEADLINE, batch_deadline = None, hedge = False, max_workers = 1,
+									 rollup_path = None, search_path = None):
+	# If {skip_near_duplicates} is True, rewrites of a story whose header hasn't
+	# materially changed (e.g. "UPDATE 1-..." --> "UPDATE 2-...") aren't downloaded.
+	# They keep their own header and link, take their author and publish_date
+	# from the article the story_cluster column points to, their text is left
+	# NaN and the reused column is True. Recurring headers without a rewrite
+	# prefix ("Stocks to watch") are always downloaded.
+	# The story_cluster column holds the article id of each story's first article.
+	# Articles that timed out or failed have their cause in the fetch_error column.
+	# {request_deadline}, {batch_deadline}, {hedge} and {max_workers} are passed on
+	# to reuters_fetch.fetch_links_to_data(). If {rollup_path} / {search_path} are
+	# given, the articles are added to the rollups / search index there.
 	news_releases = get_data_for_stock_lb_base(stock, days_to_look_back)
-	datas = []
-	for link in news_releases['link']:
-		data = convert_link_to_data(link)
-		datas.append(data)
-	return pd.DataFrame(datas, columns = ['author', 'publish_date', 'text'])
\ No newline at end of file
+	story_clusters, unchanged = assign_header_clusters(news_releases['text'].tolist())
+	links = news_releases['link'].values.tolist()
+	unchanged = get_reusable_rewrites(news_releases['text'].tolist(), links, [stock] * len(links), story_clusters, unchanged)
+	reused = np.array([skip_near_duplicates and unchanged[position] for position in range(len(links))], dtype = bool)
+	to_fetch = np.flatnonzero(~reused).tolist()
+	fetched, retry_queue = fetch_links_to_data([links[position] for position in to_fetch], request_deadline, batch_deadline, hedge, max_workers)
+	fetched.index = to_fetch
+	causes = dict(zip(retry_queue['link'], retry_queue['cause']))
+	fetched['fetch_error'] = [causes.get(links[position], np.nan) for position in to_fetch]
+	fetched = fetched.reindex(range(len(links)))
+	for column in ['author', 'publish_date']: # One at a time, authors are lists
+		values = fetched[column].values.astype(object)
+		values[reused] = values[story_clusters[reused]]
+		fetched[column] = values
+	datas = pd.DataFrame({'header': news_releases['text'].values, 'link': links})
+	datas[['author', 'publish_date', 'text', 'fetch_error']] = fetched[['author', 'publish_date', 'body_text', 'fetch_error']].values
+	datas['story_cluster'] = [get_article_id(link) for link in news_releases['link'].values[story_clusters]]
+	datas['reused'] = reused
+	index_new_articles(datas.assign(stock = stock), rollup_path, search_path)
+	return datas
+
+def index_new_articles(datas, rollup_path = None, search_path = None):
+	# index_new_articles()
+
+	# Scores the headers of newly scraped articles and adds them to the daily
+	# sentiment rollups at {rollup_path}, and adds their headers and bodies to
+	# the search index at {search_path}. Either is skipped if its path is None.
+	# Articles that are already in the rollups / search index are skipped, as
+	# are articles that weren't downloaded (reused rewrites, failed downloads).
+	# Scoring needs NLTK's VADER lexicon (python -m nltk.downloader vader_lexicon).
+	# Errors are printed, not raised, so the scraped articles aren't lost.
+
+	# Input: datas (pd.DataFrame) - articles with stock, header, link, publish_date and text
+	#        rollup_path (str) - rollup .npz file
+	#        search_path (str) - search index folder
+	# Output: True if the articles were added, False if that failed (bool)
+
+	if len(datas) == 0:
+		return True
+	try:
+		article_ids = [get_article_id(link) for link in datas['link']]
+		if rollup_path is not None:
+			analyzer = SIA()
+			sentiments = pd.DataFrame([analyzer.polarity_scores(header) if isinstance(header, str) else {} for header in datas['header']],
+									  columns = ['neg', 'neu', 'pos', 'compound'])
+			update_rollups(pd.DataFrame({'article_id': article_ids,
+										 'stock': datas['stock'].values,
+										 'article_publish_date': datas['publish_date'].values,
+										 'compound_sentiment': sentiments['compound'].values,
+										 'pos_sentiment': sentiments['pos'].values,
+										 'neg_sentiment': sentiments['neg'].values}), rollup_path)
+
+		if search_path is not None:
+			downloaded = np.array([isinstance(text, str) for text in datas['text']], dtype = bool)
+			update_search_index(np.array(article_ids)[downloaded], datas['stock'].values[downloaded], datas['publish_date'].values[downloaded],
+								datas['header'].fillna('').values[downloaded] + ' ' + datas['text'].values[downloaded], search_path)
+	except Exception as e:
+		print('Adding articles to the rollups / search index failed: {}'.format(e))
+		return False
+	return True
+
+def retry_failed_fetches(request_deadline = REQUEST_DEADLINE, batch_deadline = None, hedge = False, max_workers = 1, path = 'retry_queue',
+						 data_path = 'reuters_data.csv', rollup_path = ROLLUP_FILE, search_path = SEARCH_INDEX_DIR):
+	# retry_failed_fetches()
+
+	# Downloads the articles in the retry queues ({path}/{stock}.csv) again.
+	# Bodies that make it go to the stock's shard of the body store, like in
+	# get_data_for_stock(). Articles that fail again stay in the queue, and a
+	# queue file is removed once all of its articles made it.
+	# If the consolidated dataset ({data_path}) exists, the articles that made
+	# it get their author and publish date filled in there, are added to the
+	# rollups and are indexed again with their bodies.
+
+	# Input: request_deadline, batch_deadline, hedge, max_workers - passed on to
+	#        reuters_fetch.fetch_links_to_data()
+	#        path (str) - retry queue folder
+	#        data_path (str) - reuters_data.csv from get_historical_reuters_data.py
+	#        rollup_path (str) - rollup .npz file
+	#        search_path (str) - search index folder
+	# Output: pd.DataFrame (stock, link, author, publish_date, body_text, article_id)
+	#         of the articles that made it this time
+
+	retried = []
+	if os.path.isdir(path):
+		for file in sorted(os.listdir(path)):
+			if not file.endswith('.csv'):
+				continue
+			queue_path = os.path.join(path, file)
+			stock = file[:-4]
+			links = pd.read_csv(queue_path)['link'].tolist()
+			links_data, retry_queue = fetch_links_to_data(links, request_deadline, batch_deadline, hedge, max_workers)
+			links_data.insert(0, 'link', links)
+			links_data.insert(0, 'stock', stock)
+			links_data['article_id'] = [get_article_id(link) for link in links]
+			links_data = links_data[~links_data['link'].isin(retry_queue['link'])]
+			write_bodies_to_store(links_data['article_id'], links_data['publish_date'], links_data['body_text'], stock)
+			retried.append(links_data)
+
+			if len(retry_queue) > 0:
+				retry_queue.to_csv(queue_path, index = False)
+			else:
+				os.remove(queue_path)
+
+	if len(retried) == 0:
+		return pd.DataFrame(columns = ['stock', 'link', 'author', 'publish_date', 'body_text', 'article_id'])
+	retried = pd.concat(retried, ignore_index = True)
+	if os.path.exists(data_path):
+		update_retried_articles(retried, data_path, rollup_path, search_path)
+	return retried
+
+def update_retried_articles(retried, data_path = 'reuters_data.csv', rollup_path = ROLLUP_FILE, search_path = SEARCH_INDEX_DIR):
+	# update_retried_articles()
+
+	# Fills in the author and publish date of articles whose download made it
+	# on a retry in the consolidated dataset, adds them to the rollups (they
+	# were left out without a publish date) and indexes them again with their
+	# bodies (they were indexed by header only).
+
+	# Input: retried (pd.DataFrame) - from retry_failed_fetches()
+	#        data_path, rollup_path, search_path - see retry_failed_fetches()
+	# Output: the rows of {data_path} that were updated (pd.DataFrame)
+
+	datas = pd.read_csv(data_path, index_col = 0)
+	found = retried.drop_duplicates(['stock', 'link']).set_index(['stock', 'link'])
+	keys = pd.MultiIndex.from_arrays([datas['stock'].astype(str).values, datas['reuters_url'].values])
+	matched = keys.isin(found.index)
+	found = found.reindex(keys[matched])
+	datas[['author', 'article_publish_date']] = datas[['author', 'article_publish_date']].astype(object) # May be all NaN
+	datas.loc[matched, 'author'] = found['author'].astype(str).values
+	datas.loc[matched, 'article_publish_date'] = found['publish_date'].tolist()
+	datas.to_csv(data_path)
+
+	updated = datas[matched]
+	if len(updated) == 0:
+		return updated
+	update_rollups(updated, rollup_path)
+	update_search_index(updated['article_id'], updated['stock'], updated['article_publish_date'],
+						updated['raw_header'].fillna('') + ' ' + found['body_text'].fillna('').values, search_path, replace = True)
+	return updated
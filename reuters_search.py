@@ -0,0 +1,457 @@
+# Dependencies
+
+# built-ins
+import os # making and reading directories
+from collections import OrderedDict # for the open segment cache
+import re # for splitting text into words
+import shutil # for clearing the index before a rebuild
+import hashlib # for hashing terms
+
+# 3rd-party
+import numpy as np # for the index arrays
+import pandas as pd # for data processing
+from reuters_lock import file_lock # for updating the index from several processes
+
+# Inverted index over the consolidated articles, so a keyword search doesn't
+# mean loading reuters_data.csv and running str.contains over every body.
+# Every word and every pair of neighbouring words (so phrases like "guidance
+# cut" can be looked up directly) is a term. The index is a folder of
+# segments; every build or update adds segments. Updates of a few articles
+# make small segments, so after each update neighbouring small segments are
+# merged (see merge_segments()), which keeps the amount of segments - and the
+# time a search takes - down. Writers hold search_index.lock.
+# Each segment is a folder of .npy files, memory-mapped when searched:
+# term_hashes  - sorted 64-bit hashes of the segment's terms
+# term_offsets - where each term's postings start in postings
+# postings     - document numbers of each term, delta-encoded as varints
+# word_hashes  - sorted 64-bit hashes of the segment's words
+# word_ids     - id of each of those words, the most common words having the
+#                smallest ids (so they take one byte as a varint)
+# doc_words    - each document's words in order, as word ids encoded as
+#                varints; doc_offsets is where each document starts.
+#                Phrases of 3+ words are checked against these, since having
+#                all of a phrase's word pairs doesn't mean they're next to each other
+# article_ids, stocks, dates - one entry per document, for results and filters
+SEARCH_INDEX_DIR = 'search_index'
+SEGMENT_SIZE = 10000 # Documents per segment, keeps memory use down while building
+MERGE_RATIO = 2 # Neighbouring segments are merged once the newer one has at least
+				# 1 / MERGE_RATIO of the older one's documents, as long as they fit in SEGMENT_SIZE
+MAX_OPEN_SEGMENTS = 32 # Segments kept memory-mapped between searches (each holds ~11 open files)
+WORD = re.compile(r'\w+')
+MISSING_DAY = np.iinfo(np.int64).min # What missing (NaT) publish dates are stored as
+
+_segment_cache = OrderedDict() # segment path --> (inode, dict of memory-mapped arrays), least recently used first
+_index_cache = {} # index path --> {'sizes': segment name --> amount of documents, 'keys': set of (article_id, stock)}
+
+# Functions
+def get_terms(text):
+	# get_terms()
+
+	# Input: text (str) - article header and/or body
+	# Output: list of terms (strs): lowercase words and pairs of neighbouring words
+
+	words = get_words(text)
+	return words + [' '.join(pair) for pair in zip(words, words[1:])]
+
+def get_words(text):
+	# Lowercase words of {text}, in order
+	if not isinstance(text, str):
+		return []
+	return WORD.findall(text.lower())
+
+def hash_terms(terms):
+	# Stable 64-bit hash of each term, so the index doesn't have to store the terms themselves
+	return np.array([int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size = 8).digest(), 'little') for term in terms], dtype = np.uint64)
+
+def _varint_lengths(values):
+	# Amount of bytes each value takes as a varint
+	num_bytes = np.ones(len(values), dtype = np.int64)
+	for shift in (7, 14, 21, 28):
+		num_bytes += values >= (1 << shift)
+	return num_bytes
+
+def encode_varints(values):
+	# encode_varints()
+
+	# 7 bits per byte, high bit set on every byte except a value's last one,
+	# so small numbers (the gaps between document numbers) take one byte.
+
+	# Input: values (np.array of uint32s)
+	# Output: encoded bytes (np.array of uint8s)
+
+	values = values.astype(np.uint64)
+	num_bytes = _varint_lengths(values)
+	starts = np.cumsum(num_bytes) - num_bytes
+
+	encoded = np.zeros(int(num_bytes.sum()), dtype = np.uint8)
+	for k in range(5):
+		has_byte = num_bytes > k
+		byte = (values[has_byte] >> np.uint64(7 * k)) & np.uint64(127)
+		byte |= np.where(num_bytes[has_byte] > k + 1, 128, 0).astype(np.uint64) # More bytes follow
+		encoded[starts[has_byte] + k] = byte
+	return encoded
+
+def decode_varints(encoded):
+	# decode_varints()
+
+	# Input: encoded (np.array of uint8s) - from encode_varints()
+	# Output: values (np.array of int64s)
+
+	encoded = np.asarray(encoded)
+	if len(encoded) == 0:
+		return np.array([], dtype = np.int64)
+	ends = np.flatnonzero(encoded < 128) # Last byte of each value
+	starts = np.concatenate([[0], ends[:-1] + 1])
+	shifts = np.arange(len(encoded)) - np.repeat(starts, ends - starts + 1)
+	parts = (encoded & 127).astype(np.int64) << (7 * shifts)
+	return np.add.reduceat(parts, starts)
+
+def _to_day_numbers(dates):
+	# Turns publish dates into UTC day numbers (days since 1970-01-01)
+	dates = pd.to_datetime(pd.Series(dates), utc = True, errors = 'coerce', format = 'mixed').dt.tz_convert(None)
+	return dates.values.astype('datetime64[D]').astype(np.int64)
+
+def _write_segment(path, article_ids, stocks, dates, texts):
+	# Builds one segment from a batch of documents
+	postings = {} # term --> document numbers, in increasing order
+	doc_words = [] # words of each document, in order
+	for doc, text in enumerate(texts):
+		words = get_words(text)
+		doc_words.append(words)
+		for term in set(words + [' '.join(pair) for pair in zip(words, words[1:])]):
+			postings.setdefault(term, []).append(doc)
+
+	terms = list(postings)
+	term_hashes = hash_terms(terms)
+	order = np.argsort(term_hashes)
+	lengths = np.array([len(postings[terms[i]]) for i in order], dtype = np.int64)
+	docs = np.fromiter((doc for i in order for doc in postings[terms[i]]), dtype = np.int64, count = int(lengths.sum()))
+
+	vocabulary = list(set(word for words in doc_words for word in words))
+	word_hashes = dict(zip(vocabulary, hash_terms(vocabulary).tolist()))
+	doc_word_hashes = np.fromiter((word_hashes[word] for words in doc_words for word in words), dtype = np.uint64)
+	doc_lengths = np.array([len(words) for words in doc_words], dtype = np.int64)
+	_save_segment(path, term_hashes[order], lengths, docs, doc_word_hashes, doc_lengths, article_ids, stocks, _to_day_numbers(dates))
+
+def _save_segment(path, term_hashes, lengths, docs, doc_word_hashes, doc_lengths, article_ids, stocks, days):
+	# Writes a segment. {term_hashes} are sorted, {lengths} is how many documents
+	# each term has and {docs} holds them, term by term, in increasing order.
+	# {doc_word_hashes} are the hashes of every document's words, in order,
+	# {doc_lengths} the amount of words of each document.
+
+	# Delta-encode within each term: the first document number is kept as is
+	deltas = np.diff(docs, prepend = 0)
+	term_starts = np.cumsum(lengths) - lengths
+	deltas[term_starts] = docs[term_starts]
+	encoded = encode_varints(deltas)
+
+	# Byte offset of each term's postings
+	value_ends = np.cumsum(lengths) - 1
+	byte_ends = np.cumsum(_varint_lengths(deltas))
+	term_offsets = np.concatenate([[0], byte_ends[value_ends]]).astype(np.int64)
+
+	# Forward index: every document's words as ids, most common word first
+	word_hashes, doc_word_positions, counts = np.unique(doc_word_hashes, return_inverse = True, return_counts = True)
+	word_ids = np.empty(len(word_hashes), dtype = np.int64)
+	word_ids[np.argsort(-counts, kind = 'stable')] = np.arange(len(word_hashes))
+	doc_word_ids = word_ids[doc_word_positions.reshape(-1)]
+	doc_offsets = np.concatenate([[0], np.cumsum(_varint_lengths(doc_word_ids))])[np.concatenate([[0], np.cumsum(doc_lengths)])]
+
+	os.makedirs(path)
+	np.save(os.path.join(path, 'term_hashes.npy'), term_hashes)
+	np.save(os.path.join(path, 'term_offsets.npy'), term_offsets)
+	np.save(os.path.join(path, 'postings.npy'), encoded)
+	np.save(os.path.join(path, 'word_hashes.npy'), word_hashes)
+	np.save(os.path.join(path, 'word_ids.npy'), word_ids)
+	np.save(os.path.join(path, 'doc_words.npy'), encode_varints(doc_word_ids))
+	np.save(os.path.join(path, 'doc_offsets.npy'), doc_offsets.astype(np.int64))
+	np.save(os.path.join(path, 'article_ids.npy'), np.array(article_ids, dtype = str))
+	np.save(os.path.join(path, 'stocks.npy'), np.array(stocks, dtype = str))
+	np.save(os.path.join(path, 'dates.npy'), np.asarray(days, dtype = np.int64)) # Missing dates are NaT once read back
+
+def _value_counts(encoded, byte_offsets):
+	# Amount of varints between neighbouring {byte_offsets} of {encoded}
+	ends = np.concatenate([[0], np.cumsum(np.asarray(encoded) < 128)])
+	return np.diff(ends[byte_offsets])
+
+def _read_segment(segment):
+	# Undoes _save_segment(): a segment's postings as (term hash, document)
+	# pairs, and its documents' words as hashes
+	lengths = _value_counts(segment['postings'], segment['term_offsets'])
+	deltas = decode_varints(segment['postings'])
+	totals = np.cumsum(deltas)
+	term_starts = np.cumsum(lengths) - lengths
+	docs = totals - np.repeat(totals[term_starts] - deltas[term_starts], lengths)
+	term_hashes = np.repeat(np.asarray(segment['term_hashes']), lengths)
+
+	id_hashes = np.empty(len(segment['word_ids']), dtype = np.uint64)
+	id_hashes[segment['word_ids']] = segment['word_hashes']
+	doc_word_hashes = id_hashes[decode_varints(segment['doc_words'])]
+	doc_lengths = _value_counts(segment['doc_words'], segment['doc_offsets'])
+	return term_hashes, docs, doc_word_hashes, doc_lengths
+
+def _merge_two(older_path, newer_path, merged_path):
+	# Writes the documents of two neighbouring segments to {merged_path}, the
+	# older segment's first. An article indexed again (replace = True) only
+	# keeps its newest copy.
+	segments = [_read_arrays(older_path), _read_arrays(newer_path)]
+	article_ids = np.concatenate([segment['article_ids'] for segment in segments])
+	stocks = np.concatenate([segment['stocks'] for segment in segments])
+	days = np.concatenate([segment['dates'] for segment in segments])
+	keep = ~pd.Series(list(zip(article_ids, stocks))).duplicated(keep = 'last').values
+	new_numbers = np.cumsum(keep) - 1
+
+	term_hashes, docs, doc_word_hashes, doc_lengths = [], [], [], []
+	first_doc = 0
+	for segment in segments:
+		segment_terms, segment_docs, segment_words, segment_lengths = _read_segment(segment)
+		segment_docs = segment_docs + first_doc
+		kept = keep[segment_docs]
+		term_hashes.append(segment_terms[kept])
+		docs.append(new_numbers[segment_docs[kept]])
+		segment_keep = keep[first_doc:first_doc + len(segment['article_ids'])]
+		doc_word_hashes.append(segment_words[np.repeat(segment_keep, segment_lengths)])
+		doc_lengths.append(segment_lengths[segment_keep])
+		first_doc += len(segment['article_ids'])
+
+	term_hashes, docs = np.concatenate(term_hashes), np.concatenate(docs)
+	order = np.lexsort((docs, term_hashes))
+	unique_hashes, lengths = np.unique(term_hashes[order], return_counts = True)
+	_save_segment(merged_path, unique_hashes, lengths, docs[order], np.concatenate(doc_word_hashes), np.concatenate(doc_lengths),
+				  article_ids[keep], stocks[keep], days[keep])
+	return int(keep.sum())
+
+def _segment_names(path):
+	# Segment folders of the index, oldest first
+	return sorted(name for name in os.listdir(path) if name.startswith('segment_'))
+
+def _get_index_state(path):
+	# Amount of documents of each segment and the (article_id, stock) pairs in
+	# the index. Kept between updates; only segments that are new since the
+	# last call are read, unless segments were removed by another process.
+	names = _segment_names(path)
+	state = _index_cache.get(path)
+	if state is None or not set(state['sizes']) <= set(names):
+		state = {'sizes': {}, 'keys': set()}
+	for name in names:
+		if name not in state['sizes']:
+			article_ids = np.load(os.path.join(path, name, 'article_ids.npy'))
+			stocks = np.load(os.path.join(path, name, 'stocks.npy'))
+			state['sizes'][name] = len(article_ids)
+			state['keys'].update(zip(article_ids.tolist(), stocks.tolist()))
+	_index_cache[path] = state
+	return state
+
+def merge_segments(path = SEARCH_INDEX_DIR):
+	# merge_segments()
+
+	# Merges neighbouring segments once the newer one has at least
+	# 1 / MERGE_RATIO of the older one's documents and they fit in
+	# SEGMENT_SIZE, newest first, until no two can be merged. Like carrying in
+	# binary addition, this leaves a few segments of growing size behind the
+	# full ones, and every document is rewritten only a few times.
+	# update_search_index() calls it after every update.
+	# The merged segment replaces the newer one, so segments stay in the order
+	# they were written in.
+
+	# Input: path (str) - search index folder
+	# Output: amount of merges done (int)
+
+	with file_lock(path):
+		return _merge_segments(path)
+
+def _merge_segments(path):
+	state = _get_index_state(path)
+	num_merges = 0
+	while True:
+		names = _segment_names(path)
+		sizes = [state['sizes'][name] for name in names]
+		pairs = [i for i in range(len(names) - 1, 0, -1)
+				 if sizes[i - 1] + sizes[i] <= SEGMENT_SIZE and sizes[i - 1] <= MERGE_RATIO * sizes[i]
+				 and all(os.path.exists(os.path.join(path, names[j], 'doc_words.npy')) for j in (i - 1, i))]
+		if len(pairs) == 0:
+			return num_merges
+		older, newer = names[pairs[0] - 1], names[pairs[0]]
+		older_path, newer_path = os.path.join(path, older), os.path.join(path, newer)
+		merged_path, replaced_path = os.path.join(path, '.merging'), os.path.join(path, '.replaced')
+		for temp_path in (merged_path, replaced_path):
+			if os.path.isdir(temp_path): # Left over by a merge that crashed
+				shutil.rmtree(temp_path)
+		size = _merge_two(older_path, newer_path, merged_path)
+
+		# Swap the merged segment in. Until the older segment is removed its
+		# documents are in the index twice, which search() drops.
+		for segment_path in (older_path, newer_path):
+			_segment_cache.pop(segment_path, None)
+		os.rename(newer_path, replaced_path)
+		os.rename(merged_path, newer_path)
+		shutil.rmtree(older_path)
+		shutil.rmtree(replaced_path)
+		del state['sizes'][older]
+		state['sizes'][newer] = size
+		num_merges += 1
+
+def update_search_index(article_ids, stocks, publish_dates, texts, path = SEARCH_INDEX_DIR, replace = False):
+	# update_search_index()
+
+	# Adds newly scraped articles to the index as new segments. Articles that
+	# are already in the index for the same stock are skipped, unless {replace}
+	# is True: then they're indexed again (e.g. once a failed download made it)
+	# and search() only returns the newest copy. The new text should contain
+	# the old one, since an old copy that matches is still dropped.
+
+	# Input: article_ids (list of strs) - ids from reuters_body_store.get_article_id()
+	#        stocks (list of strs) - ticker symbol of each article
+	#        publish_dates (list) - publish date of each article
+	#        texts (list of strs) - text to index, e.g. header + ' ' + body
+	#        path (str) - search index folder
+	#        replace (bool) - index articles that are already in the index again
+	# Output: amount of segments written (int)
+
+	article_ids, stocks, publish_dates, texts = list(article_ids), list(stocks), list(publish_dates), list(texts)
+	os.makedirs(path, exist_ok = True)
+	with file_lock(path):
+		state = _get_index_state(path)
+		new, added = [], set()
+		for i, key in enumerate(zip(map(str, article_ids), map(str, stocks))):
+			if key not in added and (replace or key not in state['keys']):
+				added.add(key)
+				new.append(i)
+		article_ids, stocks = [article_ids[i] for i in new], [stocks[i] for i in new]
+		publish_dates, texts = [publish_dates[i] for i in new], [texts[i] for i in new]
+
+		names = _segment_names(path)
+		next_segment = int(names[-1][len('segment_'):]) + 1 if len(names) > 0 else 0
+		num_segments = 0
+		for start in range(0, len(article_ids), SEGMENT_SIZE):
+			end = start + SEGMENT_SIZE
+			segment_name = 'segment_{:06d}'.format(next_segment + num_segments)
+			_write_segment(os.path.join(path, segment_name), article_ids[start:end], stocks[start:end], publish_dates[start:end], texts[start:end])
+			state['sizes'][segment_name] = len(article_ids[start:end])
+			num_segments += 1
+		state['keys'].update(added)
+		_merge_segments(path)
+	return num_segments
+
+def build_search_index(article_ids, stocks, publish_dates, texts, path = SEARCH_INDEX_DIR):
+	# build_search_index()
+
+	# Same as update_search_index(), but clears the index first.
+
+	with file_lock(path):
+		for segment in list(_segment_cache):
+			if os.path.dirname(segment) == path:
+				del _segment_cache[segment]
+		_index_cache.pop(path, None)
+		if os.path.isdir(path):
+			shutil.rmtree(path)
+	return update_search_index(article_ids, stocks, publish_dates, texts, path)
+
+def _read_arrays(segment_path):
+	# All of a segment's arrays, read into memory
+	return {name[:-4]: np.load(os.path.join(segment_path, name)) for name in os.listdir(segment_path) if name.endswith('.npy')}
+
+def _load_segment(segment_path):
+	# Segments are memory-mapped once and kept open for the next searches, up
+	# to MAX_OPEN_SEGMENTS of them (the least recently used is closed first).
+	# A merge writes a new folder in place of the newer segment, so the
+	# folder's inode tells if the kept one is still current.
+	inode = os.stat(segment_path).st_ino
+	if segment_path in _segment_cache and _segment_cache[segment_path][0] == inode:
+		_segment_cache.move_to_end(segment_path)
+		return _segment_cache[segment_path][1]
+	segment = {name[:-4]: np.load(os.path.join(segment_path, name), mmap_mode = 'r')
+			   for name in os.listdir(segment_path) if name.endswith('.npy')}
+	_segment_cache[segment_path] = (inode, segment)
+	_segment_cache.move_to_end(segment_path)
+	while len(_segment_cache) > MAX_OPEN_SEGMENTS:
+		_segment_cache.popitem(last = False)
+	return segment
+
+def _get_postings(segment, term_hash):
+	# Document numbers of one term in one segment
+	i = np.searchsorted(segment['term_hashes'], term_hash)
+	if i == len(segment['term_hashes']) or segment['term_hashes'][i] != term_hash:
+		return np.array([], dtype = np.int64)
+	encoded = segment['postings'][segment['term_offsets'][i]:segment['term_offsets'][i + 1]]
+	return np.cumsum(decode_varints(encoded))
+
+def _has_phrase(segment, doc, phrase_ids):
+	# True if the document's words contain {phrase_ids} (word ids) back to back
+	words = decode_varints(segment['doc_words'][segment['doc_offsets'][doc]:segment['doc_offsets'][doc + 1]])
+	if len(words) < len(phrase_ids):
+		return False
+	windows = np.lib.stride_tricks.sliding_window_view(words, len(phrase_ids))
+	return bool((windows == phrase_ids).all(axis = 1).any())
+
+def search(query, start = None, end = None, tickers = None, phrase = True, path = SEARCH_INDEX_DIR):
+	# search()
+
+	# Finds articles containing {query}, optionally filtered by date and ticker.
+
+	# Input: query (str) - words to look for, e.g. "guidance cut". An empty
+	#                      query matches every article (useful with filters)
+	#        start, end (anything pd.Timestamp accepts) - publish date range (UTC days,
+	#                                                      inclusive). Articles without a publish
+	#                                                      date are left out when either is given
+	#        tickers (list of strs) - only articles for these stocks
+	#        phrase (bool) - True: the words have to appear next to each other, in order
+	#                        False: the words can appear anywhere in the article
+	#        path (str) - search index folder
+	# Output: pd.DataFrame (article_id, stock, publish_date), one row per
+	#         matching article per stock, sorted by publish date
+
+	words = WORD.findall(query.lower())
+	if phrase and len(words) > 1:
+		terms = [' '.join(pair) for pair in zip(words, words[1:])]
+	else:
+		terms = words
+	term_hashes = hash_terms(terms)
+	word_hashes = hash_terms(words)
+	start_day = _to_day_numbers([start])[0] if start is not None else None
+	end_day = _to_day_numbers([end])[0] if end is not None else None
+
+	results = []
+	for segment_name in _segment_names(path):
+		try:
+			segment = _load_segment(os.path.join(path, segment_name))
+		except FileNotFoundError:
+			continue # Merged into a later segment by another process since it was listed
+
+		docs = None
+		for term_hash in term_hashes:
+			postings = _get_postings(segment, term_hash)
+			docs = postings if docs is None else np.intersect1d(docs, postings, assume_unique = True)
+			if len(docs) == 0:
+				break
+		if docs is None:
+			docs = np.arange(len(segment['article_ids']))
+
+		# Date and ticker facets
+		if start_day is not None or end_day is not None:
+			docs = docs[segment['dates'][docs] != MISSING_DAY]
+		if start_day is not None:
+			docs = docs[segment['dates'][docs] >= start_day]
+		if end_day is not None:
+			docs = docs[segment['dates'][docs] <= end_day]
+		if tickers is not None:
+			docs = docs[np.isin(segment['stocks'][docs], tickers)]
+
+		# A document with every word pair of a 3+ word phrase can still have them
+		# apart, so the remaining documents are checked word by word. Any document
+		# left has every word of the phrase, so they're all in word_hashes.
+		# (Segments written before doc_words existed only get the word pair check.)
+		if phrase and len(words) > 2 and len(docs) > 0 and 'doc_words' in segment:
+			phrase_ids = segment['word_ids'][np.searchsorted(segment['word_hashes'], word_hashes)]
+			docs = docs[np.array([_has_phrase(segment, doc, phrase_ids) for doc in docs], dtype = bool)]
+
+		if len(docs) > 0:
+			results.append(pd.DataFrame({'article_id': segment['article_ids'][docs],
+										 'stock': segment['stocks'][docs],
+										 'publish_date': segment['dates'][docs].astype('datetime64[D]')}))
+
+	if len(results) == 0:
+		return pd.DataFrame(columns = ['article_id', 'stock', 'publish_date'])
+	# Articles indexed again with replace = True are in a later segment
+	results = pd.concat(results, ignore_index = True).drop_duplicates(['article_id', 'stock'], keep = 'last')
+	return results.sort_values('publish_date', kind = 'stable').reset_index(drop = True)